@@ -1,12 +1,32 @@
 #!/usr/bin/env python3
 import os
 import sys
+import hashlib
+import argparse
+import functools
+import heapq
+import shutil
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import logging
 
+try:
+    import duckdb # Optional: vectorized fetch of the base query
+except ImportError:
+    duckdb = None
+
+try:
+    import pyarrow as pa # Optional: C++ CSV writer for the output dataset
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq # Optional: Parquet copy of the dataset for training
+except ImportError:
+    pa = None
+    pacsv = None
+    pq = None
+
 # Add project root to Python path to allow importing from src
 project_root = Path(__file__).resolve().parent.parent
 if str(project_root) not in sys.path:
@@ -33,6 +53,8 @@ except ImportError:
             logging.error(f"Error connecting to database (fallback): {e}")
             return None
 
+from src.utils.json_io import read_json, write_json
+
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -43,6 +65,29 @@ TARGET_AH_LINE = -0.5 # The Asian Handicap line for the target
 ODDS_MARKET_ID = 1 # Match Winner market ID
 ODDS_BOOKMAKER_ID = 20 # Bookmaker ID for 1x2 odds
 
+# Build the dataset through DuckDB's sqlite scanner when duckdb is installed.
+# Falls back to the sqlite3 + pandas pipeline otherwise.
+USE_DUCKDB = True
+
+# Rows per batch for the pandas pipeline (fetch, features and CSV write are streamed)
+FETCH_BATCH_SIZE = 50000
+
+# Rows per record batch serialized by pyarrow's CSV writer (its default is 1024)
+CSV_WRITE_BATCH_SIZE = 65536
+
+# Worker processes for the pandas pipeline; > 1 partitions the build by season_id
+# and runs each season on its own read-only connection
+BUILD_WORKERS = os.cpu_count() or 1
+
+# Read-only bulk query: large page cache (~256MB), memory-mapped I/O (1GB)
+# and in-memory temp B-trees for the CTE/sort stages
+READ_PRAGMAS = """
+    PRAGMA cache_size = -262144;
+    PRAGMA mmap_size = 1073741824;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA query_only = 1;
+"""
+
 
 # List of half-time stats required for both home and away teams
 HALF_TIME_STATS_COLS = [
@@ -50,11 +95,21 @@ HALF_TIME_STATS_COLS = [
     "successful_passes_percentage", "ball_possession", "saves",
     "attacks", "shots_total", "shots_insidebox"
 ]
+# 'goals' is required for the 2H calculation; ensure it once, at import
+if 'goals' not in HALF_TIME_STATS_COLS:
+    logging.warning("Adding 'goals' to HALF_TIME_STATS_COLS as it's required for 2H calculation.")
+    HALF_TIME_STATS_COLS.insert(0, 'goals')
 
-def build_sql_query():
+@functools.lru_cache(maxsize=2)
+def build_sql_query(partition_by_season=False):
     """
     Constructs the SQL query to fetch data needed for 2H target calculation.
     Includes HT stats (esp. goals), final scores, and 1x2 odds.
+
+    First-half stats and 1x2 odds are each pivoted to one row per fixture
+    with conditional aggregation, so the main SELECT needs only two joins.
+    With partition_by_season=True every stage is restricted to the season
+    bound to the $season_id parameter.
     """
     select_clauses = [
         "s.fixture_id",
@@ -64,37 +119,66 @@ def build_sql_query():
         "s.away_score"    # Final away score
         ]
 
-    # Add clauses for home team stats (MUST include 'goals')
-    if 'goals' not in HALF_TIME_STATS_COLS:
-        logging.warning("Adding 'goals' to HALF_TIME_STATS_COLS as it's required for 2H calculation.")
-        HALF_TIME_STATS_COLS.insert(0, 'goals') # Ensure goals is present
-
+    # Pivot columns: pick the home/away team's first-half row for each stat
+    pivot_clauses = []
     for stat in HALF_TIME_STATS_COLS:
-        select_clauses.append(f"fs_home.{stat} AS ht_home_{stat}")
+        pivot_clauses.append(f"MAX(CASE WHEN fs.team_id = sch.home_team_id THEN fs.{stat} END) AS ht_home_{stat}")
+        select_clauses.append(f"vf.ht_home_{stat}")
 
     # Add clauses for away team stats (MUST include 'goals')
     for stat in HALF_TIME_STATS_COLS:
-        select_clauses.append(f"fs_away.{stat} AS ht_away_{stat}")
+        pivot_clauses.append(f"MAX(CASE WHEN fs.team_id = sch.away_team_id THEN fs.{stat} END) AS ht_away_{stat}")
+        select_clauses.append(f"vf.ht_away_{stat}")
 
     # Add clauses for 1x2 odds values (Home, Draw, Away)
-    select_clauses.append("fo_home.value AS odds_home")
-    select_clauses.append("fo_draw.value AS odds_draw")
-    select_clauses.append("fo_away.value AS odds_away")
+    select_clauses.append("op.odds_home")
+    select_clauses.append("op.odds_draw")
+    select_clauses.append("op.odds_away")
+
+    # SQLite >= 3.35 accepts the MATERIALIZED hint; force a single pass over
+    # fixture_stats for the GROUP BY instead of letting the planner inline it.
+    materialized_hint = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
 
-    # Construct the SQL query with a CTE to identify valid fixtures first
+    season_filter_stats = season_filter_odds = season_filter_main = ""
+    if partition_by_season:
+        season_filter_stats = "\n            AND fs.fixture_id IN (SELECT fixture_id FROM schedules WHERE season_id = $season_id)"
+        season_filter_odds = "\n            AND fixture_id IN (SELECT fixture_id FROM schedules WHERE season_id = $season_id)"
+        season_filter_main = "\n        AND s.season_id = $season_id"
+
+    # Construct the SQL query with CTEs that pivot stats and odds per fixture first
     sql = f"""
-    WITH ValidFixtures AS (
-        -- Selects fixtures with 'first_half' stats for exactly two teams
+    WITH ValidFixtures AS {materialized_hint}(
+        -- Fixtures with 'first_half' stats for exactly two teams,
+        -- pivoted into ht_home_* / ht_away_* columns
         SELECT
-            fixture_id
+            fs.fixture_id,
+            {', '.join(pivot_clauses)}
         FROM
-            fixture_stats
+            fixture_stats fs
+        INNER JOIN
+            schedules sch ON sch.fixture_id = fs.fixture_id
         WHERE
-            period = 'first_half'
+            fs.period = 'first_half'{season_filter_stats}
         GROUP BY
-            fixture_id
+            fs.fixture_id
         HAVING
-            COUNT(DISTINCT team_id) = 2
+            COUNT(DISTINCT fs.team_id) = 2
+    ),
+    OddsPivot AS {materialized_hint}(
+        -- 1x2 odds for the configured market/bookmaker, one row per fixture
+        SELECT
+            fixture_id,
+            MAX(CASE WHEN label = 'Home' THEN value END) AS odds_home,
+            MAX(CASE WHEN label = 'Draw' THEN value END) AS odds_draw,
+            MAX(CASE WHEN label = 'Away' THEN value END) AS odds_away
+        FROM
+            fixture_odds
+        WHERE
+            market_id = {ODDS_MARKET_ID}
+            AND bookmaker_id = {ODDS_BOOKMAKER_ID}
+            AND label IN ('Home', 'Draw', 'Away'){season_filter_odds}
+        GROUP BY
+            fixture_id
     )
     SELECT
         {', '.join(select_clauses)}
@@ -103,42 +187,101 @@ def build_sql_query():
     INNER JOIN
         ValidFixtures vf ON s.fixture_id = vf.fixture_id
     LEFT JOIN
-        fixture_stats fs_home ON s.fixture_id = fs_home.fixture_id
-                             AND s.home_team_id = fs_home.team_id
-                             AND fs_home.period = 'first_half'
-    LEFT JOIN
-        fixture_stats fs_away ON s.fixture_id = fs_away.fixture_id
-                             AND s.away_team_id = fs_away.team_id
-                             AND fs_away.period = 'first_half'
-    LEFT JOIN
-        fixture_odds fo_home ON s.fixture_id = fo_home.fixture_id
-                            AND fo_home.market_id = {ODDS_MARKET_ID}
-                            AND fo_home.bookmaker_id = {ODDS_BOOKMAKER_ID}
-                            AND fo_home.label = 'Home'
-    LEFT JOIN
-        fixture_odds fo_draw ON s.fixture_id = fo_draw.fixture_id
-                            AND fo_draw.market_id = {ODDS_MARKET_ID}
-                            AND fo_draw.bookmaker_id = {ODDS_BOOKMAKER_ID}
-                            AND fo_draw.label = 'Draw'
-    LEFT JOIN
-        fixture_odds fo_away ON s.fixture_id = fo_away.fixture_id
-                            AND fo_away.market_id = {ODDS_MARKET_ID}
-                            AND fo_away.bookmaker_id = {ODDS_BOOKMAKER_ID}
-                            AND fo_away.label = 'Away'
+        OddsPivot op ON s.fixture_id = op.fixture_id
     WHERE
         s.status IN ('FT', 'AET', 'FT_PEN') -- Ensure fixture finished
         AND s.home_score IS NOT NULL        -- Need final scores
         AND s.away_score IS NOT NULL
         -- Need first half goals to calculate second half goals
-        AND fs_home.goals IS NOT NULL
-        AND fs_away.goals IS NOT NULL
-    GROUP BY
-        s.fixture_id
+        AND vf.ht_home_goals IS NOT NULL
+        AND vf.ht_away_goals IS NOT NULL{season_filter_main}
+        -- No outer GROUP BY: both CTEs already yield one row per fixture_id
     ORDER BY
         s.fixture_id;
     """
     return sql
 
+def connect_duckdb():
+    """
+    Opens an in-memory DuckDB connection with the SQLite database attached
+    read-only as the default catalog, so the SQLite-dialect queries run as-is.
+    """
+    duck_conn = duckdb.connect()
+    try:
+        try:
+            duck_conn.execute("LOAD sqlite") # Already installed: no network access needed
+        except duckdb.Error:
+            duck_conn.execute("INSTALL sqlite; LOAD sqlite;") # Downloads the extension once
+        escaped_db_path = str(DATABASE_PATH).replace("'", "''")
+        duck_conn.execute(f"ATTACH '{escaped_db_path}' AS fb (TYPE sqlite, READ_ONLY)")
+        duck_conn.execute("USE fb")
+    except Exception:
+        duck_conn.close()
+        raise
+    return duck_conn
+
+def iter_base_data(conn, sql_query, params=None, batch_size=FETCH_BATCH_SIZE, use_duckdb=USE_DUCKDB):
+    """
+    Executes the base query and yields the result as DataFrames of at most
+    (roughly) batch_size rows, so peak memory does not grow with history size.
+
+    Uses DuckDB attached to the SQLite file (read-only) when use_duckdb is set
+    and duckdb is importable, so chunks are materialized in C++ rather than
+    converted one by one through Python. If DuckDB cannot run the query (e.g.
+    the sqlite extension cannot be loaded) it falls back to a sqlite3 cursor.
+    """
+    if use_duckdb and duckdb is not None:
+        duck_conn = None
+        try:
+            duck_conn = connect_duckdb()
+            result = duck_conn.execute(sql_query, params) if params else duck_conn.execute(sql_query)
+        except Exception as e:
+            logging.warning(f"DuckDB fetch failed ({e}). Falling back to sqlite3.")
+            if duck_conn is not None:
+                duck_conn.close()
+            duck_conn = None
+        if duck_conn is not None:
+            logging.info("Fetching base data via DuckDB sqlite scanner.")
+            try:
+                # DuckDB hands out chunks in vectors of 2048 rows
+                vectors_per_chunk = max(1, batch_size // 2048)
+                while True:
+                    chunk = result.fetch_df_chunk(vectors_per_chunk)
+                    if chunk.empty:
+                        break
+                    yield chunk
+            finally:
+                duck_conn.close()
+            return
+
+    # Plain tuples straight from the cursor; from_records builds each batch
+    # column-wise instead of going through read_sql_query's row handling
+    cursor = conn.cursor()
+    try:
+        cursor.row_factory = None
+        cursor.execute(sql_query, params or ())
+        columns = [desc[0] for desc in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+    finally:
+        cursor.close()
+
+def coerce_numeric_columns(df):
+    """
+    Converts the odds, score and half-time stat columns to numeric in one pass.
+    Values stay float64 so the written odds features and differentials are exact.
+    Unparseable values become NaN.
+    """
+    numeric_cols = ['odds_home', 'odds_draw', 'odds_away', 'home_score', 'away_score']
+    for stat in HALF_TIME_STATS_COLS:
+        numeric_cols.extend([f"ht_home_{stat}", f"ht_away_{stat}"])
+    numeric_cols = [col for col in dict.fromkeys(numeric_cols) if col in df.columns]
+    df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
+    return df
+
 def calculate_odds_features_and_target(df, target_ah_line):
     """
     Calculates odds-based features (implied probabilities, fav/und odds)
@@ -146,10 +289,13 @@ def calculate_odds_features_and_target(df, target_ah_line):
 
     Args:
         df (pd.DataFrame): DataFrame containing odds, final scores, HT scores, team IDs.
+                           Numeric columns are expected to be coerced already
+                           (see coerce_numeric_columns).
         target_ah_line (float): The AH line to check coverage for (e.g., -0.5).
 
     Returns:
-        pd.DataFrame: DataFrame with added odds features and 'target_2H' column.
+        pd.DataFrame: DataFrame with added odds features, 'favorite_idx'
+                      (int8: 0 = home, 2 = away) and 'target_2H' column.
                       Returns None if input df is empty or required columns are missing.
     """
     if df.empty:
@@ -164,14 +310,12 @@ def calculate_odds_features_and_target(df, target_ah_line):
         logging.error(f"Missing required columns for odds/target calculation. Need: {required_cols}. Missing: {missing}")
         return None
 
-    # --- Coerce and Handle Missing Odds ---
+    # --- Handle Missing Odds ---
     odds_cols = ['odds_home', 'odds_draw', 'odds_away']
-    for col in odds_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
 
     # Drop rows if essential 1x2 odds are missing (needed for favorite ID and features)
     initial_rows = len(df)
-    df.dropna(subset=odds_cols, inplace=True)
+    df = df.dropna(subset=odds_cols)
     if len(df) < initial_rows:
         logging.warning(f"Dropped {initial_rows - len(df)} rows due to missing essential 1x2 odds.")
 
@@ -180,40 +324,10 @@ def calculate_odds_features_and_target(df, target_ah_line):
         return None
     # --- End Handle Missing Odds ---
 
-    # --- Calculate Odds Features ---
-    logging.info("Calculating odds-based features...")
-    # Implied Probabilities
-    df['implied_prob_home'] = 1 / df['odds_home']
-    df['implied_prob_draw'] = 1 / df['odds_draw']
-    df['implied_prob_away'] = 1 / df['odds_away']
-    # Probability Margin (Bookmaker's Edge)
-    df['prob_margin'] = (df['implied_prob_home'] + df['implied_prob_draw'] + df['implied_prob_away']) - 1
-    # Odds Ratio
-    df['odds_ratio_hw'] = df['odds_home'] / df['odds_away'] # Home/Away ratio
-
-    # Identify favorite
-    conditions = [
-        (df['odds_home'] <= df['odds_draw']) & (df['odds_home'] <= df['odds_away']), # Home Fav
-        (df['odds_away'] < df['odds_draw']) & (df['odds_away'] < df['odds_home']),  # Away Fav
-    ]
-    choices_id = [df['home_team_id'], df['away_team_id']]
-    choices_loc = ['home', 'away']
-    df['favorite_team_id'] = np.select(conditions, choices_id, default=np.nan) # Should not be NaN due to dropna above
-    df['favorite_location'] = np.select(conditions, choices_loc, default=None)
-
-    # Favorite and Underdog Odds
-    df['odds_fav'] = np.where(df['favorite_location'] == 'home', df['odds_home'], df['odds_away'])
-    df['odds_und'] = np.where(df['favorite_location'] == 'home', df['odds_away'], df['odds_home'])
-    logging.info("Finished calculating odds features.")
-    # --- End Calculate Odds Features ---
-
-
     # --- Calculate Second Half Scores ---
     score_cols = ['home_score', 'away_score', 'ht_home_goals', 'ht_away_goals']
-    for col in score_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
     initial_rows = len(df)
-    df.dropna(subset=score_cols, inplace=True) # Need scores for target
+    df = df.dropna(subset=score_cols) # Need scores for target
     if len(df) < initial_rows:
         logging.warning(f"Dropped {initial_rows - len(df)} rows due to missing score components needed for 2H target.")
     if df.empty:
@@ -223,24 +337,59 @@ def calculate_odds_features_and_target(df, target_ah_line):
     df['sh_away_goals'] = df['away_score'] - df['ht_away_goals']
     # --- End Calculate Second Half Scores ---
 
+    # --- Calculate Odds Features ---
+    logging.info("Calculating odds-based features...")
+    # Stack the 1x2 odds once as an (N, 3) matrix (home, draw, away)
+    odds_mat = df[odds_cols].to_numpy(dtype=np.float64, copy=True) # Own, writable buffer
+
+    # Implied Probabilities (one reciprocal over the whole matrix)
+    implied_probs = np.reciprocal(odds_mat)
+    df[['implied_prob_home', 'implied_prob_draw', 'implied_prob_away']] = implied_probs
+    # Probability Margin (Bookmaker's Edge)
+    df['prob_margin'] = implied_probs.sum(axis=1) - 1.0
+    # Odds Ratio
+    df['odds_ratio_hw'] = odds_mat[:, 0] / odds_mat[:, 2] # Home/Away ratio
+
+    # Identify favorite in one pass over the odds matrix.
+    # argmin keeps the first minimum, so home wins ties with draw/away;
+    # a draw favorite (index 1) means no clear favorite and the row is
+    # dropped before the target is computed.
+    # Kept as a compact int8 code (not a 'home'/'away' string column) so all
+    # downstream masks are integer comparisons.
+    fav_idx = np.argmin(odds_mat, axis=1).astype(np.int8) # 0 = home, 1 = draw, 2 = away
+    fav_is_home = fav_idx == 0
+    fav_is_away = fav_idx == 2
+    df['favorite_team_id'] = np.where(fav_is_home, df['home_team_id'],
+                                      np.where(fav_is_away, df['away_team_id'], np.nan))
+    df['favorite_idx'] = fav_idx
+
+    # Favorite and Underdog Odds (gathered from the same matrix; underdog is the
+    # opposite end of the home/away pair)
+    rows = np.arange(len(df))
+    df['odds_fav'] = odds_mat[rows, fav_idx]
+    df['odds_und'] = odds_mat[rows, 2 - fav_idx]
+    logging.info("Finished calculating odds features.")
+    # --- End Calculate Odds Features ---
+
 
     # --- Calculate 2H Target ---
     target_col_name = f'target_fav_covers_ah_{str(target_ah_line).replace(".","_").replace("-","neg")}_2H'
-    df[target_col_name] = np.nan # Initialize target column
-
-    home_fav_covers_2H = (df['favorite_location'] == 'home') & \
-                         (df['sh_home_goals'] > df['sh_away_goals']) # Home wins 2H covers AH -0.5
-
-    away_fav_covers_2H = (df['favorite_location'] == 'away') & \
-                         (df['sh_away_goals'] > df['sh_home_goals']) # Away wins 2H covers AH -0.5
 
-    df.loc[home_fav_covers_2H, target_col_name] = 1
-    df.loc[away_fav_covers_2H, target_col_name] = 1
-    df.loc[df['favorite_location'].notna() & df[target_col_name].isna(), target_col_name] = 0 # Fill remaining with 0
+    # Drop rows without a clear favorite (draw priced shortest); no target for them
+    has_favorite = fav_is_home | fav_is_away
+    if not has_favorite.all():
+        logging.warning(f"Dropped {int((~has_favorite).sum())} rows with no clear home/away favorite.")
+        df = df[has_favorite].copy()
+        fav_is_home = fav_is_home[has_favorite]
+
+    # Favorite covers AH -0.5 in the 2nd half if it wins the 2nd half outright
+    sh_home = df['sh_home_goals'].to_numpy()
+    sh_away = df['sh_away_goals'].to_numpy()
+    df[target_col_name] = np.where(fav_is_home, sh_home > sh_away, sh_away > sh_home).astype(np.int8)
     # --- End Calculate 2H Target ---
 
     # Log counts
-    valid_targets = df[target_col_name].notna().sum()
+    valid_targets = len(df)
     covers = int(df[target_col_name].sum())
     no_covers = valid_targets - covers
 
@@ -249,14 +398,337 @@ def calculate_odds_features_and_target(df, target_ah_line):
     logging.info(f" - Favorite covered AH {target_ah_line} (2H): {covers}")
     logging.info(f" - Favorite did not cover AH {target_ah_line} (2H): {no_covers}")
 
-    # Drop rows where target is still NaN (shouldn't happen if favorite_location is notna)
-    df.dropna(subset=[target_col_name], inplace=True)
-
     return df
 
 
-def build_dataset():
-    """Fetches data, processes, adds odds features, calculates 2H target, saves dataset."""
+def build_duckdb_feature_query(sql_query, target_col_name):
+    """
+    Wraps the base query in a DuckDB query that computes the full output dataset
+    (differentials, odds features and 2H target) with the same rules as the
+    pandas path: rows missing odds or score components are dropped, the
+    favorite is the first-lowest of home/draw/away odds (ties go home) and
+    rows where the draw is favorite are dropped, missing stats count as 0.
+    """
+    base_query = sql_query.strip().rstrip(';')
+    cols_for_features = [col for col in HALF_TIME_STATS_COLS if col != 'goals']
+
+    diff_clauses = []
+    for stat in cols_for_features + ['goals']:
+        home_col = f"COALESCE(ht_home_{stat}, 0)"
+        away_col = f"COALESCE(ht_away_{stat}, 0)"
+        diff_clauses.append(
+            f"CAST(CASE WHEN favorite_location = 'home' THEN {home_col} - {away_col} "
+            f"ELSE {away_col} - {home_col} END AS DOUBLE) AS ht_diff_{stat}"
+        )
+
+    return f"""
+    WITH base AS (
+        {base_query}
+    ),
+    with_favorite AS (
+        SELECT
+            *,
+            CASE
+                WHEN odds_home <= odds_draw AND odds_home <= odds_away THEN 'home'
+                WHEN odds_draw < odds_home AND odds_draw <= odds_away THEN 'draw'
+                ELSE 'away'
+            END AS favorite_location
+        FROM
+            base
+        WHERE
+            odds_home IS NOT NULL AND odds_draw IS NOT NULL AND odds_away IS NOT NULL
+            AND home_score IS NOT NULL AND away_score IS NOT NULL
+            AND ht_home_goals IS NOT NULL AND ht_away_goals IS NOT NULL
+    )
+    SELECT
+        fixture_id,
+        {', '.join(diff_clauses)},
+        odds_home, odds_draw, odds_away,
+        1.0 / odds_home AS implied_prob_home,
+        1.0 / odds_draw AS implied_prob_draw,
+        1.0 / odds_away AS implied_prob_away,
+        1.0 / odds_home + 1.0 / odds_draw + 1.0 / odds_away - 1.0 AS prob_margin,
+        odds_home / odds_away AS odds_ratio_hw,
+        CASE WHEN favorite_location = 'home' THEN odds_home ELSE odds_away END AS odds_fav,
+        CASE WHEN favorite_location = 'home' THEN odds_away ELSE odds_home END AS odds_und,
+        CAST(CASE
+            WHEN favorite_location = 'home'
+                THEN (home_score - ht_home_goals) > (away_score - ht_away_goals)
+            ELSE (away_score - ht_away_goals) > (home_score - ht_home_goals)
+        END AS TINYINT) AS {target_col_name}
+    FROM
+        with_favorite
+    WHERE
+        favorite_location <> 'draw'
+    ORDER BY
+        fixture_id
+    """
+
+def build_dataset_duckdb(sql_query, target_col_name, output_path):
+    """
+    Builds the final dataset entirely inside DuckDB and writes it to output_path.
+    Returns True if the CSV was written, False if the DuckDB path is unavailable
+    or failed (the caller then falls back to the pandas pipeline).
+    """
+    duck_conn = None
+    try:
+        duck_conn = connect_duckdb()
+        feature_query = build_duckdb_feature_query(sql_query, target_col_name)
+        duck_conn.execute(f"CREATE TEMP TABLE ml_dataset AS {feature_query}")
+        final_rows, covers = duck_conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM({target_col_name}), 0) FROM ml_dataset"
+        ).fetchone()
+        logging.info(f"Final dataset size (DuckDB): {final_rows} rows.")
+        if final_rows == 0:
+            logging.warning("DuckDB feature query returned no rows.")
+            return False
+
+        logging.info(f"Target '{target_col_name}' calculation (2nd Half Only, AH {TARGET_AH_LINE}):")
+        logging.info(f" - Favorite covered AH {TARGET_AH_LINE} (2H): {covers}")
+        logging.info(f" - Favorite did not cover AH {TARGET_AH_LINE} (2H): {final_rows - covers}")
+
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        escaped_path = str(output_path).replace("'", "''")
+        duck_conn.execute(f"COPY ml_dataset TO '{escaped_path}' (HEADER, DELIMITER ',')")
+        return True
+    except Exception as e:
+        logging.warning(f"DuckDB feature pipeline failed ({e}). Falling back to pandas.")
+        return False
+    finally:
+        if duck_conn is not None:
+            duck_conn.close()
+
+def get_source_state(conn, sql_query):
+    """
+    Cheap fingerprint of the data the build depends on: finished fixtures
+    (max id + count), the highest rowids in fixture_stats/fixture_odds (new or
+    replaced rows bump these) and a hash of the query/target definition.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT
+                (SELECT MAX(fixture_id) FROM schedules WHERE status IN ('FT', 'AET', 'FT_PEN')),
+                (SELECT COUNT(*) FROM schedules WHERE status IN ('FT', 'AET', 'FT_PEN')),
+                (SELECT MAX(rowid) FROM fixture_stats),
+                (SELECT MAX(rowid) FROM fixture_odds)
+        """)
+        max_fixture_id, row_count, stats_max_rowid, odds_max_rowid = cursor.fetchone()
+    finally:
+        cursor.close()
+    schema_hash = hashlib.sha1(f"{sql_query}|{TARGET_AH_LINE}".encode("utf-8")).hexdigest()
+    return {
+        'max_fixture_id': max_fixture_id,
+        'row_count': row_count,
+        'stats_max_rowid': stats_max_rowid,
+        'odds_max_rowid': odds_max_rowid,
+        'schema_hash': schema_hash,
+    }
+
+def get_meta_path(output_path):
+    """Path of the JSON sidecar recording the source state of the last build."""
+    return output_path.with_suffix('.meta.json')
+
+def is_dataset_up_to_date(output_path, source_state):
+    """True if the CSV exists and its sidecar matches the current source state."""
+    meta_path = get_meta_path(output_path)
+    if not output_path.exists() or not meta_path.exists():
+        return False
+    try:
+        return read_json(meta_path) == source_state
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read dataset metadata {meta_path}: {e}")
+        return False
+
+def write_dataset_meta(output_path, source_state):
+    """Records the source state the dataset at output_path was built from."""
+    write_json(get_meta_path(output_path), source_state)
+
+def get_parquet_path(output_path):
+    """Path of the Parquet copy of the dataset CSV at output_path."""
+    return output_path.with_suffix('.parquet')
+
+def write_dataset_parquet(output_path):
+    """
+    Writes a Snappy-compressed Parquet copy of the dataset CSV, which the
+    training scripts load column-wise instead of parsing the CSV.
+    Needs pyarrow; returns the Parquet path, or None if it was not written.
+    """
+    if pq is None:
+        return None
+    parquet_path = get_parquet_path(output_path)
+    try:
+        pq.write_table(pacsv.read_csv(output_path), parquet_path, compression='snappy')
+        logging.info(f"Parquet copy of the dataset saved to: {parquet_path}")
+        return parquet_path
+    except Exception as e:
+        logging.warning(f"Could not write Parquet copy of the dataset ({e}).")
+        parquet_path.unlink(missing_ok=True)
+        return None
+
+def write_dataset_csv(df, output_path, append=False):
+    """
+    Writes the final dataset to CSV, using pyarrow's C++ writer when available.
+    Falls back to pandas.to_csv if pyarrow is not installed.
+    With append=True the rows are added to the existing file without a header.
+    """
+    if pacsv is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        write_options = pacsv.WriteOptions(include_header=not append, batch_size=CSV_WRITE_BATCH_SIZE)
+        with open(output_path, 'ab' if append else 'wb') as f:
+            pacsv.write_csv(table, f, write_options=write_options)
+    else:
+        df.to_csv(output_path, mode='a' if append else 'w', header=not append, index=False)
+
+
+def build_feature_frame(df, target_col_name):
+    """
+    Runs the pandas feature pipeline on one batch of base rows: numeric coercion,
+    odds features and 2H target, stat imputation and differentials.
+    Returns the output columns, or None if no rows survive.
+    """
+    df = coerce_numeric_columns(df)
+
+    # 2. Calculate Odds Features and 2H Target Variable
+    logging.info(f"Calculating odds features and 2H target for AH {TARGET_AH_LINE}...")
+    df = calculate_odds_features_and_target(df, TARGET_AH_LINE)
+
+    if df is None or df.empty:
+        logging.warning("Batch became empty or None during odds/target calculation.")
+        return None
+
+    # 3. Define Predictor Columns & Impute Missing Stats
+    # Stack home/away stats (plus HT goals, already non-null) as (N, K) matrices;
+    # imputation and differentials both run on these, the raw stat columns in df
+    # are not needed downstream
+    cols_for_features = [col for col in HALF_TIME_STATS_COLS if col != 'goals']
+    diff_stats = cols_for_features + ['goals']
+    home_mat = df[[f"ht_home_{stat}" for stat in diff_stats]].to_numpy(dtype=np.float64, copy=True) # Own, writable buffers for the in-place imputation
+    away_mat = df[[f"ht_away_{stat}" for stat in diff_stats]].to_numpy(dtype=np.float64, copy=True)
+
+    logging.info(f"Imputing missing values in stats columns ({2 * len(cols_for_features)} columns) with 0...")
+    missing_stats_before = int((np.isnan(home_mat).any(axis=1) | np.isnan(away_mat).any(axis=1)).sum())
+    logging.info(f"Rows with at least one missing STAT value before imputation: {missing_stats_before}/{len(df)}")
+    np.nan_to_num(home_mat, copy=False, nan=0.0)
+    np.nan_to_num(away_mat, copy=False, nan=0.0)
+    logging.info("Missing stats values imputed with 0.")
+
+    # --- Feature Engineering (Differentials including goal difference) ---
+    logging.info("Calculating feature differentials (Favorite - Underdog)...")
+    # Every differential in a single vectorized pass
+    fav_is_home = df['favorite_idx'].to_numpy() == 0
+    home_minus_away = home_mat - away_mat
+    diff_mat = np.where(fav_is_home[:, None], home_minus_away, -home_minus_away)
+    feature_cols_diffs = [f"ht_diff_{stat}" for stat in diff_stats]
+    df[feature_cols_diffs] = diff_mat
+    logging.info(f"Created {len(feature_cols_diffs)} differential features.")
+    # --- End Feature Engineering ---
+
+    # --- Define Final Feature Set (including odds features) ---
+    odds_feature_cols = [
+        'odds_home', 'odds_draw', 'odds_away', # Raw odds
+        'implied_prob_home', 'implied_prob_draw', 'implied_prob_away', # Implied probabilities
+        'prob_margin', # Bookmaker margin
+        'odds_ratio_hw', # Home/Away odds ratio
+        'odds_fav', 'odds_und' # Favorite/Underdog odds
+        ]
+    all_feature_cols = feature_cols_diffs + odds_feature_cols
+    logging.info(f"Total features defined: {len(all_feature_cols)}")
+    # --- End Define Final Feature Set ---
+
+    # 4. Select Final Columns for Output
+    final_output_cols = ['fixture_id'] + all_feature_cols + [target_col_name]
+    # Ensure all selected columns actually exist in the dataframe
+    final_output_cols = [col for col in final_output_cols if col in df.columns]
+    missing_final_cols = [col for col in (['fixture_id'] + all_feature_cols + [target_col_name]) if col not in final_output_cols]
+    if missing_final_cols:
+        logging.warning(f"Columns expected but not found in final selection: {missing_final_cols}")
+
+    return df[final_output_cols]
+
+
+def write_feature_csv(conn, sql_query, output_path, target_col_name, params=None, use_duckdb=USE_DUCKDB):
+    """
+    Streams the base query through build_feature_frame batch by batch into a CSV.
+    Returns (base_rows, final_rows); the file is only created if final_rows > 0.
+    """
+    base_rows = 0
+    final_rows = 0
+    for batch in iter_base_data(conn, sql_query, params, use_duckdb=use_duckdb):
+        base_rows += len(batch)
+        logging.info(f"Processing batch of {len(batch)} base rows ({base_rows} so far)...")
+        final_df = build_feature_frame(batch, target_col_name)
+        if final_df is None or final_df.empty:
+            continue
+        write_dataset_csv(final_df, output_path, append=final_rows > 0)
+        final_rows += len(final_df)
+    return base_rows, final_rows
+
+def build_season_shard(season_id, shard_path, target_col_name, use_duckdb=USE_DUCKDB):
+    """
+    Worker: builds the dataset rows for one season into shard_path on its own
+    read-only connection. use_duckdb is decided once by the parent, so workers
+    do not each retry a DuckDB setup that already failed. Returns (base_rows, final_rows).
+    """
+    # as_uri() percent-encodes characters such as '#', '?' and '%' in the path
+    conn = sqlite3.connect(Path(DATABASE_PATH).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        conn.executescript(READ_PRAGMAS)
+        return write_feature_csv(conn, build_sql_query(partition_by_season=True), shard_path,
+                                 target_col_name, params={'season_id': season_id}, use_duckdb=use_duckdb)
+    finally:
+        conn.close()
+
+def write_partitioned_feature_csv(conn, output_path, target_col_name, max_workers=BUILD_WORKERS,
+                                  use_duckdb=USE_DUCKDB):
+    """
+    Builds one CSV shard per season in a process pool, then merges the shards
+    (each sorted by fixture_id) into output_path with a single header, so rows
+    stay in global fixture_id order as in the unpartitioned query.
+    Returns (base_rows, final_rows).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT season_id FROM schedules WHERE status IN ('FT', 'AET', 'FT_PEN') ORDER BY season_id")
+        season_ids = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    if not season_ids:
+        return 0, 0
+
+    shard_dir = output_path.with_name(output_path.name + '.shards')
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        shard_paths = [shard_dir / f"shard_{season_id}.csv" for season_id in season_ids]
+        logging.info(f"Building {len(season_ids)} season shards with up to {max_workers} workers...")
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(season_ids))) as executor:
+            futures = [executor.submit(build_season_shard, season_id, shard_path, target_col_name, use_duckdb)
+                       for season_id, shard_path in zip(season_ids, shard_paths)]
+            results = [future.result() for future in futures]
+
+        shards = [open(shard_path, 'rb') for shard_path in shard_paths if shard_path.exists()]
+        try:
+            headers = [shard.readline() for shard in shards]
+            with open(output_path, 'wb') as out:
+                if headers:
+                    out.write(headers[0])
+                # fixture_id is the first column; streaming k-way merge of the sorted shards
+                out.writelines(heapq.merge(*shards, key=lambda line: int(line.split(b',', 1)[0])))
+        finally:
+            for shard in shards:
+                shard.close()
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    base_rows = sum(result[0] for result in results)
+    final_rows = sum(result[1] for result in results)
+    return base_rows, final_rows
+
+def build_dataset(force=False):
+    """
+    Fetches data, processes, adds odds features, calculates 2H target, saves dataset.
+    Skips the rebuild when the saved dataset matches the current DB state, unless force is set.
+    """
     logging.info(f"=== Starting ML Predictor Dataset Build (Incl. Odds Features, Target: 2H AH {TARGET_AH_LINE}) ===")
 
     conn = get_db_connection()
@@ -264,106 +736,71 @@ def build_dataset():
         logging.critical("Failed to connect to the database. Exiting.")
         sys.exit(1)
 
+    conn.executescript(READ_PRAGMAS)
+
     try:
         # 1. Construct and Execute SQL Query
         sql_query = build_sql_query()
+        output_path = PROCESSED_DATA_DIR / OUTPUT_FILENAME
+        source_state = get_source_state(conn, sql_query)
+        if not force and is_dataset_up_to_date(output_path, source_state):
+            logging.info(f"Dataset at {output_path} is up-to-date with the database. Skipping rebuild (use --force to override).")
+            if not get_parquet_path(output_path).exists():
+                write_dataset_parquet(output_path)
+            return
+
+        target_col_name = f'target_fav_covers_ah_{str(TARGET_AH_LINE).replace(".","_").replace("-","neg")}_2H'
+
+        # Fast path: the whole feature pipeline as one DuckDB query, written straight to CSV.
+        # If it fails, the fallback below does not try DuckDB again
+        use_duckdb = USE_DUCKDB and duckdb is not None
+        if use_duckdb:
+            logging.info(f"Building dataset via DuckDB and saving to: {output_path}")
+            get_meta_path(output_path).unlink(missing_ok=True)
+            get_parquet_path(output_path).unlink(missing_ok=True)
+            if build_dataset_duckdb(sql_query, target_col_name, output_path):
+                write_dataset_parquet(output_path)
+                write_dataset_meta(output_path, source_state)
+                logging.info("Dataset saved successfully.")
+                return
+            use_duckdb = False
+
+        # 2-4. Stream batches through the feature pipeline into a temp CSV,
+        # swapped in for the real output once every batch is written
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        get_meta_path(output_path).unlink(missing_ok=True) # stale until the new CSV is written
+        get_parquet_path(output_path).unlink(missing_ok=True)
         logging.info("Executing SQL query to fetch base data...")
         try:
-            df = pd.read_sql_query(sql_query, conn)
-            logging.info(f"Successfully fetched {len(df)} base rows.")
-        except pd.io.sql.DatabaseError as e:
+            if BUILD_WORKERS > 1:
+                base_rows, final_rows = write_partitioned_feature_csv(conn, tmp_path, target_col_name,
+                                                                      use_duckdb=use_duckdb)
+            else:
+                base_rows, final_rows = write_feature_csv(conn, sql_query, tmp_path, target_col_name,
+                                                          use_duckdb=use_duckdb)
+        except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
              logging.error(f"Database error executing query: {e}")
-             sys.exit(1)
-        except Exception as e:
-             logging.error(f"An unexpected error occurred during query execution: {e}")
+             tmp_path.unlink(missing_ok=True)
              sys.exit(1)
 
-        if df.empty:
+        if base_rows == 0:
             logging.warning("Query returned no base data. Exiting.")
             sys.exit(0)
 
-        # 2. Calculate Odds Features and 2H Target Variable
-        logging.info(f"Calculating odds features and 2H target for AH {TARGET_AH_LINE}...")
-        df = calculate_odds_features_and_target(df.copy(), TARGET_AH_LINE)
-        target_col_name = f'target_fav_covers_ah_{str(TARGET_AH_LINE).replace(".","_").replace("-","neg")}_2H'
-
-        if df is None or df.empty:
-             logging.error("DataFrame became empty or None during odds/target calculation. Exiting.")
-             sys.exit(1)
+        logging.info(f"Final dataset size: {final_rows} rows (from {base_rows} base rows).")
 
-        # 3. Define Predictor Columns & Impute Missing Stats
-        stats_cols_to_impute = []
-        cols_for_features = [col for col in HALF_TIME_STATS_COLS if col != 'goals']
-        for stat in cols_for_features:
-            home_col = f"ht_home_{stat}"
-            away_col = f"ht_away_{stat}"
-            stats_cols_to_impute.extend([home_col, away_col])
-
-        logging.info(f"Imputing missing values in stats columns ({len(stats_cols_to_impute)} columns) with 0...")
-        missing_stats_before = df[stats_cols_to_impute].isnull().any(axis=1).sum()
-        logging.info(f"Rows with at least one missing STAT value before imputation: {missing_stats_before}/{len(df)}")
-        df[stats_cols_to_impute] = df[stats_cols_to_impute].fillna(0)
-        logging.info("Missing stats values imputed with 0.")
-
-        # --- Feature Engineering (Differentials including goal difference) ---
-        logging.info("Calculating feature differentials (Favorite - Underdog)...")
-        feature_cols_diffs = []
-        for stat in cols_for_features: # Use stats excluding goals first
-            home_stat_col = f"ht_home_{stat}"
-            away_stat_col = f"ht_away_{stat}"
-            diff_col = f"ht_diff_{stat}"
-            df[diff_col] = np.where(
-                df['favorite_location'] == 'home',
-                df[home_stat_col] - df[away_stat_col],
-                df[away_stat_col] - df[home_stat_col]
-            )
-            feature_cols_diffs.append(diff_col)
-        # Add HT Goal Difference separately
-        goal_diff_col = 'ht_diff_goals'
-        df[goal_diff_col] = np.where(
-                df['favorite_location'] == 'home',
-                df['ht_home_goals'] - df['ht_away_goals'],
-                df['ht_away_goals'] - df['ht_home_goals']
-            )
-        feature_cols_diffs.append(goal_diff_col)
-        logging.info(f"Created {len(feature_cols_diffs)} differential features.")
-        # --- End Feature Engineering ---
-
-        # --- Define Final Feature Set (including odds features) ---
-        odds_feature_cols = [
-            'odds_home', 'odds_draw', 'odds_away', # Raw odds
-            'implied_prob_home', 'implied_prob_draw', 'implied_prob_away', # Implied probabilities
-            'prob_margin', # Bookmaker margin
-            'odds_ratio_hw', # Home/Away odds ratio
-            'odds_fav', 'odds_und' # Favorite/Underdog odds
-            ]
-        all_feature_cols = feature_cols_diffs + odds_feature_cols
-        logging.info(f"Total features defined: {len(all_feature_cols)}")
-        # --- End Define Final Feature Set ---
-
-        # 4. Select Final Columns for Output
-        final_output_cols = ['fixture_id'] + all_feature_cols + [target_col_name]
-        # Ensure all selected columns actually exist in the dataframe
-        final_output_cols = [col for col in final_output_cols if col in df.columns]
-        missing_final_cols = [col for col in (['fixture_id'] + all_feature_cols + [target_col_name]) if col not in final_output_cols]
-        if missing_final_cols:
-            logging.warning(f"Columns expected but not found in final selection: {missing_final_cols}")
-
-        final_df = df[final_output_cols].copy()
-
-        final_rows = len(final_df)
-        logging.info(f"Final dataset size: {final_rows} rows.")
-
-        if final_df.empty:
+        if final_rows == 0:
             logging.warning("Final DataFrame is empty after feature engineering/selection.")
+            tmp_path.unlink(missing_ok=True)
             sys.exit(0)
 
         # 5. Save Dataset
-        output_path = PROCESSED_DATA_DIR / OUTPUT_FILENAME
         logging.info(f"Saving final predictor dataset (incl. odds features) to: {output_path}")
         try:
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            final_df.to_csv(output_path, index=False)
+            tmp_path.replace(output_path)
+            write_dataset_parquet(output_path)
+            write_dataset_meta(output_path, source_state)
             logging.info("Dataset saved successfully.")
         except Exception as e:
             logging.error(f"Error saving dataset to CSV: {e}")
@@ -388,4 +825,14 @@ if __name__ == "__main__":
     except Exception as e:
         logging.warning(f"Could not create processed data directory: {e}")
 
-    build_dataset()
+    parser = argparse.ArgumentParser(
+        description="Build the ML predictor dataset (odds features + 2H AH target) from the local database."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild even if the saved dataset matches the current database state"
+    )
+    args = parser.parse_args()
+
+    build_dataset(force=args.force)
@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
 import os
 import sys
-import time
 import json
+import gzip
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import sqlite3 # Needed for DB operations
 
 # Add project root to Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.api.client import APIClient # Import APIClient directly
-from src.data.processors import process_fixture_stats_long # Import the new long format processor
+from src.api.client import APIClient, RateLimiter # Import APIClient directly
+from src.data.processors import process_fixture_stats_long, FIXTURE_STATS_COLUMNS # Import the new long format processor
 from src.data.storage import (
     get_db_connection,
     create_fixture_stats_table, # Import function to create the stats table
@@ -23,77 +24,150 @@ from src.config import RAW_DATA_DIR # For saving raw data
 # --- Configuration ---
 FIXTURE_DETAILS_RAW_DIR = RAW_DATA_DIR / "fixture_details" # Directory for raw fixture detail responses
 FIXTURE_DETAILS_RAW_DIR.mkdir(parents=True, exist_ok=True)
-API_DELAY_SECONDS = 1.5 # Optional delay between API calls per fixture
+MAX_CONCURRENT_REQUESTS = 10 # Fixture detail requests in flight at once
+MAX_REQUESTS_PER_SECOND = 3000 / 3600 # API plan limit (3000/hr ~ 1.2s/req), shared by all fetch threads; 429s back off via Retry-After
 BATCH_SIZE = 100 # Process and store stats rows in batches (e.g., 100 rows)
+ID_PAGE_SIZE = 500 # Fixture IDs read from the DB per page
 FIXTURE_LIMIT = None # <<< LIMIT FOR TESTING as requested
+RAW_GZIP_LEVEL = 1 # Fast gzip level for raw archives (JSON still shrinks several-fold)
+
+# Raw archives are compressed and written off the main loop; futures are
+# collected so write errors surface in wait_for_raw_writes()
+raw_write_pool = ThreadPoolExecutor(max_workers=2)
+pending_raw_writes = []
 
 # --- Helper Functions ---
-def get_finished_round_fixture_ids(conn, limit=None):
-    """
-    Fetches fixture IDs from the schedules table where the status is 'FT'.
-    Optionally excludes fixtures already present in the fixture_stats table.
-    Optionally limits the number of fixtures returned.
-    """
-    fixture_ids = []
+# Candidate fixtures are finished ('FT') schedules; those already present in
+# fixture_stats are filtered out in Python against a set loaded once per run
+# (load_processed_fixture_ids), rather than anti-joining the growing stats
+# table for every page of IDs.
+FINISHED_FIXTURES_FROM = """
+    FROM schedules s
+    WHERE s.status = 'FT'
+"""
+
+def load_processed_fixture_ids(conn):
+    """Returns the set of fixture IDs that already have rows in fixture_stats."""
     cursor = None
     try:
         cursor = conn.cursor()
-        # Updated query: Select fixture_id from schedules where status is 'FT'
-        # AND the fixture_id does not already exist in fixture_stats table
-        query = """
-            SELECT DISTINCT s.fixture_id
-            FROM schedules s
-            LEFT JOIN fixture_stats fs ON s.fixture_id = fs.fixture_id
-            WHERE s.status = 'FT' AND fs.fixture_id IS NULL
-            ORDER BY s.fixture_id
-        """
-
-        if limit:
-            query += f" LIMIT {int(limit)}"
-
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        fixture_ids = [row['fixture_id'] for row in rows]
-        print(f"Found {len(fixture_ids)} unprocessed fixture IDs with status 'FT' (limit applied: {limit}).")
+        # DISTINCT walks the fixture_id prefix of fixture_stats' unique index
+        cursor.execute("SELECT DISTINCT fixture_id FROM fixture_stats")
+        return {row[0] for row in cursor}
+    except sqlite3.Error as e:
+        print(f"Error reading processed fixture IDs from fixture_stats table: {e}")
+        return set()
+    finally:
+        if cursor:
+            cursor.close()
 
+def count_finished_round_fixture_ids(conn, processed_ids, limit=None):
+    """Counts the fixtures iter_finished_round_fixture_ids will yield (for progress output)."""
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT s.fixture_id {FINISHED_FIXTURES_FROM}")
+        total = sum(1 for (fixture_id,) in cursor if fixture_id not in processed_ids)
     except sqlite3.Error as e:
-        print(f"Error fetching fixture IDs from schedules table: {e}")
+        print(f"Error counting fixture IDs from schedules table: {e}")
         if "no such table: schedules" in str(e):
             print("Error: 'schedules' table not found. Run sync_schedules.py first.")
-        elif "no such table: fixture_stats" in str(e):
-             print("Info: 'fixture_stats' table not found (will be created), fetching all finished fixtures.")
-             try:
-                 # Updated fallback query to use status = 'FT' instead of round_finished = 1
-                 fallback_query = "SELECT fixture_id FROM schedules WHERE status = 'FT' ORDER BY fixture_id"
-                 if limit: fallback_query += f" LIMIT {int(limit)}"
-                 cursor.execute(fallback_query)
-                 rows = cursor.fetchall()
-                 fixture_ids = [row['fixture_id'] for row in rows]
-                 print(f"Found {len(fixture_ids)} fixture IDs with status 'FT' (fixture_stats table not present, limit: {limit}).")
-             except sqlite3.Error as e2:
-                 print(f"Error executing fallback query: {e2}")
+        return 0
     finally:
         if cursor:
             cursor.close()
-    return fixture_ids
+    if limit:
+        total = min(total, int(limit))
+    print(f"Found {total} unprocessed fixture IDs with status 'FT' (limit applied: {limit}).")
+    return total
+
+def iter_finished_round_fixture_ids(conn, processed_ids, limit=None, page_size=ID_PAGE_SIZE):
+    """
+    Yields fixture IDs from the schedules table where the status is 'FT' and
+    the fixture is not in processed_ids (see load_processed_fixture_ids), in ID order.
+    Optionally limits the number of fixtures yielded.
+
+    IDs are read in keyset-paginated pages (fixture_id > last seen), so only one
+    page is held in memory and no read cursor stays open while the caller
+    stores stats on the same connection.
+    """
+    remaining = int(limit) if limit else None
+    last_id = -1
+    while remaining is None or remaining > 0:
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT s.fixture_id {FINISHED_FIXTURES_FROM}"
+                " AND s.fixture_id > ? ORDER BY s.fixture_id LIMIT ?",
+                (last_id, page_size)
+            )
+            page = [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error fetching fixture IDs from schedules table: {e}")
+            return
+        finally:
+            if cursor:
+                cursor.close()
+        if not page:
+            return
+        for fixture_id in page:
+            if fixture_id in processed_ids:
+                continue
+            yield fixture_id
+            if remaining is not None:
+                remaining -= 1
+                if remaining <= 0:
+                    return
+        last_id = page[-1]
+        if len(page) < page_size:
+            return
+
+def write_gzip_file(file_path, payload):
+    """Writes bytes to a gzip file (runs on the raw write pool)."""
+    with gzip.open(file_path, "wb", compresslevel=RAW_GZIP_LEVEL) as f:
+        f.write(payload)
+    return file_path
 
-def save_raw_fixture_detail(data, fixture_id):
-    """Saves the raw fixture detail JSON data."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_path = FIXTURE_DETAILS_RAW_DIR / f"fixture_{fixture_id}_stats_{timestamp}.json" # Naming convention
+def save_raw_fixture_detail(content, fixture_id):
+    """
+    Saves the raw fixture detail response as gzipped JSON.
+    content is the response body as received; it is spliced into the archive
+    envelope as-is rather than re-serialized. Compression and the disk write are
+    queued on raw_write_pool so the fetch/process loop does not block on I/O.
+    """
+    fetched_at = datetime.now() # One clock read for both the file name and the envelope
+    timestamp = fetched_at.strftime("%Y%m%d_%H%M%S")
+    file_path = FIXTURE_DETAILS_RAW_DIR / f"fixture_{fixture_id}_stats_{timestamp}.json.gz" # Naming convention
     try:
-        save_data = {
-            "fetch_timestamp": datetime.now().isoformat(),
-            "fixture_id": fixture_id,
-            "fixture_data_with_stats": data # Store the full response
-        }
-        with open(file_path, "w") as f:
-            json.dump(save_data, f, indent=2)
+        # Same envelope as before: {"fetch_timestamp", "fixture_id", "fixture_data_with_stats": <full response>}
+        header = json.dumps({"fetch_timestamp": fetched_at.isoformat(), "fixture_id": fixture_id}, separators=(",", ":"))
+        payload = header[:-1].encode("utf-8") + b',"fixture_data_with_stats":' + content + b"}"
+        pending_raw_writes.append(raw_write_pool.submit(write_gzip_file, file_path, payload))
         return file_path
     except Exception as e:
         print(f"Error saving raw fixture detail for fixture {fixture_id} to {file_path}: {e}")
         return None
 
+def wait_for_raw_writes():
+    """Waits for queued raw archive writes and reports any that failed."""
+    for future in pending_raw_writes:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error writing raw fixture detail file: {e}")
+    pending_raw_writes.clear()
+
+def fetch_fixture_detail(client, rate_limiter, fixture_id):
+    """
+    Fetches one fixture with its period statistics (runs in a worker thread).
+    Returns (raw response bytes, parsed JSON).
+    """
+    endpoint = f"v3/football/fixtures/{fixture_id}?include=periods.statistics.type"
+    rate_limiter.wait()
+    print(f"Fetching details from: {endpoint}")
+    return client.get_with_content(endpoint)
+
 # --- Main Workflow ---
 def main(limit=FIXTURE_LIMIT): # Accept limit as argument
     """Fetches details for finished fixtures, processes stats (long format), and stores them."""
@@ -106,7 +180,7 @@ def main(limit=FIXTURE_LIMIT): # Accept limit as argument
         print("Failed to connect to the database. Exiting.")
         sys.exit(1)
 
-    processed_rows_batch = [] # Accumulate processed stat rows for batch insertion
+    processed_rows_batch = [] # Accumulate processed stat row tuples for batch insertion
     total_fixtures_processed = 0
     total_stats_rows_stored = 0
     fixtures_with_errors = []
@@ -119,64 +193,90 @@ def main(limit=FIXTURE_LIMIT): # Accept limit as argument
         # but doesn't hurt to have if manual updates occur later.
         # create_update_trigger(conn, stats_table_name, stats_primary_key)
 
-        # 2. Get Fixture IDs to Fetch (Applying the limit here)
-        fixture_ids_to_process = get_finished_round_fixture_ids(conn, limit=limit)
-        if not fixture_ids_to_process:
+        # 2. Load already-processed fixture IDs once, then count fixture IDs to
+        #    fetch (applying the limit here); the IDs themselves are streamed
+        #    into the fetch loop below
+        processed_ids = load_processed_fixture_ids(conn)
+        num_fixtures = count_finished_round_fixture_ids(conn, processed_ids, limit=limit)
+        if not num_fixtures:
             print("No new fixture IDs found from finished rounds to process. Exiting.")
             sys.exit(0)
 
         # 3. Initialize API Client
         client = APIClient()
-        num_fixtures = len(fixture_ids_to_process)
         print(f"Attempting to fetch stats for {num_fixtures} fixtures...")
 
-        # 4. Loop Through Fixture IDs, Fetch, Process, Store in Batches
-        for i, fixture_id in enumerate(fixture_ids_to_process):
-            print(f"\n--- Processing Fixture ID: {fixture_id} ({i+1}/{num_fixtures}) ---")
-            # Construct endpoint with periods.statistics include
-            endpoint = f"v3/football/fixtures/{fixture_id}?include=periods.statistics.type"
-            try:
-                # Fetch fixture data
-                print(f"Fetching details from: {endpoint}")
-                raw_data = client.get(endpoint)
-
-                if raw_data and 'data' in raw_data:
-                    # Optional: Save raw data
-                    save_raw_fixture_detail(raw_data, fixture_id)
-
-                    # Process the raw data to extract stats in long format (list of rows)
-                    print(f"Processing statistics for fixture {fixture_id}...")
-                    processed_stat_rows = process_fixture_stats_long(raw_data)
-
-                    if processed_stat_rows:
-                        processed_rows_batch.extend(processed_stat_rows) # Add rows to batch
-                        total_fixtures_processed += 1 # Count fixture as processed
-                        print(f"Successfully processed {len(processed_stat_rows)} stat rows for fixture {fixture_id}.")
-                    else:
-                        print(f"No valid stats processed for fixture {fixture_id}.")
-                        # Don't necessarily mark as error if API just didn't provide stats
-
-                else:
-                    print(f"No data or invalid data returned from API for fixture {fixture_id}.")
-                    fixtures_with_errors.append(fixture_id)
-
-                # Store data in batches or at the end
-                if len(processed_rows_batch) >= BATCH_SIZE or (i == num_fixtures - 1 and processed_rows_batch):
-                    print(f"\nStoring batch of {len(processed_rows_batch)} fixture stats rows...")
-                    # Use the specific storage function for long stats with INSERT OR IGNORE
-                    stored_count = store_fixture_stats_long(conn, processed_rows_batch)
-                    total_stats_rows_stored += stored_count
-                    print(f"Finished storing batch. Inserted: {stored_count}")
-                    processed_rows_batch = [] # Reset batch
-
-                # Optional delay
-                if API_DELAY_SECONDS > 0 and i < num_fixtures - 1:
-                    time.sleep(API_DELAY_SECONDS)
-
-            except Exception as e:
-                print(f"Error processing fixture {fixture_id}: {e}")
-                fixtures_with_errors.append(fixture_id)
-                # Decide if you want to continue or stop on error
+        # 4. Fetch fixtures concurrently; process and store (single DB connection)
+        #    in this thread as each response lands. At most max_pending fetches
+        #    are queued, topped up from the ID stream as they complete.
+        rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+        fixture_ids = iter_finished_round_fixture_ids(conn, processed_ids, limit=limit)
+        max_pending = 2 * MAX_CONCURRENT_REQUESTS
+        pending = {}
+        completed = 0
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            def submit_next():
+                fixture_id = next(fixture_ids, None)
+                if fixture_id is None:
+                    return False
+                pending[executor.submit(fetch_fixture_detail, client, rate_limiter, fixture_id)] = fixture_id
+                return True
+
+            while len(pending) < max_pending and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    fixture_id = pending.pop(future)
+                    completed += 1
+                    print(f"\n--- Processing Fixture ID: {fixture_id} ({completed}/{num_fixtures}) ---")
+                    try:
+                        raw_content, raw_data = future.result()
+
+                        if raw_data and 'data' in raw_data:
+                            # Optional: Save raw data (response bytes as received)
+                            save_raw_fixture_detail(raw_content, fixture_id)
+
+                            # Process the raw data to extract stats in long format (list of rows)
+                            print(f"Processing statistics for fixture {fixture_id}...")
+                            processed_stat_rows = process_fixture_stats_long(raw_data)
+
+                            if processed_stat_rows:
+                                processed_rows_batch.extend(processed_stat_rows) # Add rows to batch
+                                total_fixtures_processed += 1 # Count fixture as processed
+                                print(f"Successfully processed {len(processed_stat_rows)} stat rows for fixture {fixture_id}.")
+                            else:
+                                print(f"No valid stats processed for fixture {fixture_id}.")
+                                # Don't necessarily mark as error if API just didn't provide stats
+
+                        else:
+                            print(f"No data or invalid data returned from API for fixture {fixture_id}.")
+                            fixtures_with_errors.append(fixture_id)
+
+                        # Store data in batches
+                        if len(processed_rows_batch) >= BATCH_SIZE:
+                            print(f"\nStoring batch of {len(processed_rows_batch)} fixture stats rows...")
+                            # Use the specific storage function for long stats with INSERT OR IGNORE
+                            stored_count = store_fixture_stats_long(conn, processed_rows_batch, FIXTURE_STATS_COLUMNS)
+                            total_stats_rows_stored += stored_count
+                            print(f"Finished storing batch. Inserted: {stored_count}")
+                            processed_rows_batch.clear() # Reset batch (buffer is reused)
+
+                    except Exception as e:
+                        print(f"Error processing fixture {fixture_id}: {e}")
+                        fixtures_with_errors.append(fixture_id)
+                        # Decide if you want to continue or stop on error
+
+                    submit_next()
+
+        # Store any remaining rows
+        if processed_rows_batch:
+            print(f"\nStoring final batch of {len(processed_rows_batch)} fixture stats rows...")
+            stored_count = store_fixture_stats_long(conn, processed_rows_batch, FIXTURE_STATS_COLUMNS)
+            total_stats_rows_stored += stored_count
+            print(f"Finished storing batch. Inserted: {stored_count}")
+            processed_rows_batch.clear()
 
         print("\n--- Sync Summary ---")
         print(f"Fixture IDs attempted: {num_fixtures}")
@@ -188,6 +288,7 @@ def main(limit=FIXTURE_LIMIT): # Accept limit as argument
     except Exception as e:
         print(f"An unexpected error occurred during the main workflow: {e}")
     finally:
+        wait_for_raw_writes()
         if conn:
             conn.close()
             print("\nDatabase connection closed.")
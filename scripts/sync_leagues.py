@@ -10,12 +10,13 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from src.api.endpoints import EndpointHandler
 # Import the necessary processing and storage functions
-from src.data.processors import process_league_data, process_season_data # Import both processors
+from src.data.processors import process_league_data_batch, process_season_data # Import both processors
 from src.data.storage import (
     get_db_connection,
     create_leagues_table,
     create_seasons_table, # Import function to create the seasons table
     create_update_trigger, # Import trigger function if needed for seasons
+    drop_update_trigger,
     store_data
 )
 
@@ -50,24 +51,18 @@ def main():
 
     # 2. Process Data (Leagues and Seasons separately)
     print("Processing fetched data...")
-    processed_leagues = []
+    # Leagues are projected column-wise in one batch
+    processed_leagues = process_league_data_batch(all_raw_data)
+    skipped_leagues = len(all_raw_data) - len(processed_leagues)
+
     processed_seasons = []
     processed_season_ids = set() # Keep track of season IDs already processed to avoid duplicates
-    skipped_leagues = 0
     skipped_seasons = 0
 
     for item in all_raw_data:
         if not item: # Skip if the item itself is null/empty
-            skipped_leagues += 1
             continue
 
-        # Process league part
-        league = process_league_data(item)
-        if league:
-            processed_leagues.append(league)
-        else:
-            skipped_leagues += 1
-
         # Process season part if it exists and hasn't been processed already
         if 'currentseason' in item and item['currentseason']:
             raw_season = item['currentseason']
@@ -99,8 +94,8 @@ def main():
             # Ensure tables and triggers exist BEFORE storing data
             print(f"Ensuring database table '{leagues_table_name}' exists...")
             create_leagues_table(conn)
-            # Add trigger for leagues table if you want updated_at automatically handled
-            create_update_trigger(conn, leagues_table_name, leagues_primary_key)
+            # Leagues are upserted with updated_at set inline, so no per-row trigger is needed
+            drop_update_trigger(conn, leagues_table_name)
 
             print(f"Ensuring database table '{seasons_table_name}' exists...")
             create_seasons_table(conn)
@@ -110,7 +105,7 @@ def main():
             # Store Leagues
             if processed_leagues:
                 print(f"Storing {len(processed_leagues)} processed leagues into '{leagues_table_name}'...")
-                leagues_stored = store_data(conn, leagues_table_name, processed_leagues, leagues_primary_key)
+                leagues_stored = store_data(conn, leagues_table_name, processed_leagues, leagues_primary_key, use_upsert=True)
                 print(f"Finished storing leagues. Stored/Updated: {leagues_stored}")
             else:
                 print("No valid league data to store.")
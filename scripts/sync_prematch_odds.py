@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import os
 import sys
-import time
-import json
 import sqlite3 # Needed for DB operations
+import zlib
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from datetime import datetime
 import logging
@@ -11,24 +12,28 @@ import logging
 # Add project root to Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.api.client import APIClient # Import APIClient directly
-from src.data.processors import process_prematch_odds_data # Import the new odds processor
+from src.api.client import APIClient, RateLimiter # Import APIClient directly
+from src.data.processors import process_prematch_odds_data, FIXTURE_ODDS_COLUMNS # Import the new odds processor
 from src.data.storage import (
     get_db_connection,
     create_fixture_odds_table, # Import function to create the odds table
-    store_data                 # Use the generic store_data function
+    create_raw_responses_table, # Raw API payloads are kept in the database
+    store_raw_responses,
+    store_rows,                # Insert pre-built row tuples with one executemany
+    drop_secondary_indexes,    # Bulk loads skip secondary index upkeep...
+    recreate_indexes           # ...and rebuild the indexes once at the end
 )
-from src.config import RAW_DATA_DIR # For saving raw data
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Configuration ---
-ODDS_RAW_DIR = RAW_DATA_DIR / "prematch_odds" # Directory for raw odds responses
-ODDS_RAW_DIR.mkdir(parents=True, exist_ok=True)
-API_DELAY_SECONDS = 1.5 # Be slightly more conservative for odds endpoints
+MAX_CONCURRENT_REQUESTS = 4 # Odds requests in flight at once
+MAX_REQUESTS_PER_SECOND = 3000 / 3600 # API plan limit (3000/hr), shared by all fetch threads; 429s back off via Retry-After
 BATCH_SIZE = 200 # Process and store odds rows in batches
+RAW_BATCH_SIZE = 50 # Also flush once this many raw responses are pending
 FIXTURE_LIMIT = None # Set to a number (e.g., 50) for testing, None to process all
+BULK_LOAD_MIN_FIXTURES = 1000 # Drop secondary indexes while loading at least this many fixtures
 ODDS_TABLE_NAME = "fixture_odds"
 
 # --- Helper Functions ---
@@ -44,26 +49,25 @@ def get_finished_fixture_ids_for_odds(conn, limit=None):
 
     try:
         cursor = conn.cursor()
-        # Select fixture_id from schedules where status is finished
-        # AND the fixture_id does not already exist in fixture_odds table.
-        # We check for existence of *any* odd row for that fixture_id.
-        # Using LEFT JOIN and checking for NULL is generally efficient.
+        # Fixtures that already have *any* odd row, read once from the fixture_id
+        # prefix of ix_fo_lookup into a set
+        cursor.execute(f"SELECT DISTINCT fixture_id FROM {ODDS_TABLE_NAME}")
+        have_odds = {row[0] for row in cursor}
+
+        # Select fixture_id from schedules where status is finished (via
+        # ix_schedules_status_start), skipping those in have_odds in Python
         query = f"""
-            SELECT DISTINCT s.fixture_id
+            SELECT s.fixture_id
             FROM schedules s
-            LEFT JOIN {ODDS_TABLE_NAME} fo ON s.fixture_id = fo.fixture_id
-            WHERE s.status IN {finished_statuses} AND fo.fixture_id IS NULL
+            WHERE s.status IN ({', '.join('?' for _ in finished_statuses)})
             ORDER BY s.start_time DESC -- Process more recent fixtures first
         """
         # Alternative: Fetch all finished and let INSERT OR IGNORE handle updates/duplicates
         # query = f"SELECT fixture_id FROM schedules WHERE status IN {finished_statuses} ORDER BY start_time DESC"
 
-        if limit:
-            query += f" LIMIT {int(limit)}"
-
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        fixture_ids = [row['fixture_id'] for row in rows]
+        cursor.execute(query, finished_statuses)
+        candidates = (row[0] for row in cursor if row[0] not in have_odds)
+        fixture_ids = list(islice(candidates, int(limit) if limit else None))
         logging.info(f"Found {len(fixture_ids)} finished fixtures without odds data (Limit: {limit}).")
 
     except sqlite3.Error as e:
@@ -71,9 +75,8 @@ def get_finished_fixture_ids_for_odds(conn, limit=None):
         if f"no such table: {ODDS_TABLE_NAME}" in str(e):
              logging.info(f"'{ODDS_TABLE_NAME}' table not found (will be created), fetching all finished fixtures.")
              try:
-                 fallback_query = f"SELECT fixture_id FROM schedules WHERE status IN {finished_statuses} ORDER BY start_time DESC"
-                 if limit: fallback_query += f" LIMIT {int(limit)}"
-                 cursor.execute(fallback_query)
+                 fallback_query = f"SELECT fixture_id FROM schedules WHERE status IN ({', '.join('?' for _ in finished_statuses)}) ORDER BY start_time DESC LIMIT ?"
+                 cursor.execute(fallback_query, (*finished_statuses, int(limit) if limit else -1))
                  rows = cursor.fetchall()
                  fixture_ids = [row['fixture_id'] for row in rows]
                  logging.info(f"Found {len(fixture_ids)} finished fixture IDs (odds table not present, Limit: {limit}).")
@@ -87,23 +90,31 @@ def get_finished_fixture_ids_for_odds(conn, limit=None):
             cursor.close()
     return fixture_ids
 
-def save_raw_odds_data(data, fixture_id):
-    """Saves the raw pre-match odds JSON data for a fixture."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_path = ODDS_RAW_DIR / f"odds_{fixture_id}_{timestamp}.json"
-    try:
-        save_data = {
-            "fetch_timestamp": datetime.now().isoformat(),
-            "fixture_id": fixture_id,
-            "prematch_odds_data": data # Store the full response
-        }
-        with open(file_path, "w") as f:
-            json.dump(save_data, f, indent=2)
-        logging.debug(f"Saved raw odds data for fixture {fixture_id} to {file_path}")
-        return file_path
-    except Exception as e:
-        logging.error(f"Error saving raw odds data for fixture {fixture_id} to {file_path}: {e}")
-        return None
+def fetch_odds_data(client, rate_limiter, fixture_id):
+    """
+    Fetches the pre-match odds for one fixture (runs in a worker thread).
+    Returns (parsed JSON, raw_responses row with the compressed response body).
+    """
+    endpoint = f"v3/football/odds/pre-match/fixtures/{fixture_id}"
+    rate_limiter.wait()
+    logging.info(f"Fetching odds from: {endpoint}")
+    content, raw_data = client.get_with_content(endpoint)
+    raw_row = (fixture_id, endpoint, datetime.now().isoformat(), zlib.compress(content))
+    return raw_data, raw_row
+
+def store_odds_batch(conn, odds_rows, raw_rows):
+    """
+    Stores the pending raw responses and processed odds rows in one transaction.
+    Returns the number of odds rows inserted.
+    """
+    store_raw_responses(conn, raw_rows, commit=not odds_rows)
+    if not odds_rows:
+        return 0
+    logging.info(f"\nStoring batch of {len(odds_rows)} odds rows...")
+    # INSERT OR IGNORE semantics due to UNIQUE constraint
+    stored_count = store_rows(conn, ODDS_TABLE_NAME, FIXTURE_ODDS_COLUMNS, odds_rows, use_insert_ignore=True)
+    logging.info(f"Finished storing batch. Inserted: {stored_count}")
+    return stored_count
 
 # --- Main Workflow ---
 def main(limit=FIXTURE_LIMIT): # Accept limit as argument
@@ -116,15 +127,18 @@ def main(limit=FIXTURE_LIMIT): # Accept limit as argument
         sys.exit(1)
 
     processed_odds_batch = [] # Accumulate processed odds rows for batch insertion
+    raw_batch = [] # Raw responses stored alongside each batch
     total_fixtures_processed = 0
     total_odds_rows_stored = 0
     fixtures_with_errors = []
     fixtures_with_no_odds = 0
+    dropped_index_sqls = [] # Secondary indexes dropped for a bulk load, restored in finally
 
     try:
         # 1. Ensure Fixture Odds Table Exists
         logging.info(f"Ensuring database table '{ODDS_TABLE_NAME}' exists...")
         create_fixture_odds_table(conn)
+        create_raw_responses_table(conn)
         # No trigger needed for this table unless specifically required
 
         # 2. Get Fixture IDs to Fetch (Applying the limit here)
@@ -136,59 +150,80 @@ def main(limit=FIXTURE_LIMIT): # Accept limit as argument
         # 3. Initialize API Client
         client = APIClient()
         num_fixtures = len(fixture_ids_to_process)
+        rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND, burst=MAX_CONCURRENT_REQUESTS)
         logging.info(f"Attempting to fetch pre-match odds for {num_fixtures} fixtures...")
+        if num_fixtures >= BULK_LOAD_MIN_FIXTURES:
+            # Discovery above is done with ix_fo_lookup; rebuilding it once is
+            # cheaper than updating it on every insert of a large run
+            dropped_index_sqls = drop_secondary_indexes(conn, ODDS_TABLE_NAME)
+
+        # 4. Fetch odds concurrently (workers also compress the raw response);
+        #    process and store on this thread as each response lands. At most
+        #    max_pending fetches are queued, topped up as they complete.
+        fixture_id_iter = iter(fixture_ids_to_process)
+        max_pending = 2 * MAX_CONCURRENT_REQUESTS
+        pending = {}
+        completed = 0
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            def submit_next():
+                fixture_id = next(fixture_id_iter, None)
+                if fixture_id is None:
+                    return False
+                pending[executor.submit(fetch_odds_data, client, rate_limiter, fixture_id)] = fixture_id
+                return True
+
+            while len(pending) < max_pending and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    fixture_id = pending.pop(future)
+                    completed += 1
+                    logging.info(f"\n--- Processing Fixture ID: {fixture_id} ({completed}/{num_fixtures}) ---")
+                    try:
+                        raw_data, raw_row = future.result()
+                        raw_batch.append(raw_row) # Keep the raw response
+
+                        if raw_data: # Check if response is not None
+                            # Process the raw data to extract odds rows
+                            logging.info(f"Processing odds for fixture {fixture_id}...")
+                            processed_odds_rows = process_prematch_odds_data(raw_data)
+
+                            if processed_odds_rows:
+                                processed_odds_batch.extend(processed_odds_rows) # Add rows to batch
+                                logging.info(f"Successfully processed {len(processed_odds_rows)} odds rows for fixture {fixture_id}.")
+                            else:
+                                # This can happen if the API returns data but the list is empty
+                                logging.info(f"No valid odds found or processed for fixture {fixture_id}.")
+                                fixtures_with_no_odds += 1
+
+                            # Mark fixture as processed regardless of whether odds were found (we attempted it)
+                            total_fixtures_processed += 1
+
+                        else:
+                            # Handle cases where client.get might return None due to repeated errors
+                            logging.warning(f"No data returned from API client for fixture {fixture_id} (likely fetch error).")
+                            fixtures_with_errors.append(fixture_id)
+
+                        # Store data in batches
+                        if len(processed_odds_batch) >= BATCH_SIZE or len(raw_batch) >= RAW_BATCH_SIZE:
+                            total_odds_rows_stored += store_odds_batch(conn, processed_odds_batch, raw_batch)
+                            processed_odds_batch.clear() # Reset batches (buffers are reused)
+                            raw_batch.clear()
+
+                    except Exception as e:
+                        logging.error(f"Error processing fixture {fixture_id}: {e}", exc_info=True) # Log traceback
+                        fixtures_with_errors.append(fixture_id)
+                        # Decide if you want to continue or stop on error
+
+                    submit_next()
 
-        # 4. Loop Through Fixture IDs, Fetch, Process, Store in Batches
-        for i, fixture_id in enumerate(fixture_ids_to_process):
-            logging.info(f"\n--- Processing Fixture ID: {fixture_id} ({i+1}/{num_fixtures}) ---")
-            # Construct endpoint for pre-match odds
-            endpoint = f"v3/football/odds/pre-match/fixtures/{fixture_id}"
-            try:
-                # Fetch odds data
-                logging.info(f"Fetching odds from: {endpoint}")
-                raw_data = client.get(endpoint)
-
-                if raw_data: # Check if response is not None
-                    # Optional: Save raw data
-                    save_raw_odds_data(raw_data, fixture_id)
-
-                    # Process the raw data to extract odds rows
-                    logging.info(f"Processing odds for fixture {fixture_id}...")
-                    processed_odds_rows = process_prematch_odds_data(raw_data)
-
-                    if processed_odds_rows:
-                        processed_odds_batch.extend(processed_odds_rows) # Add rows to batch
-                        logging.info(f"Successfully processed {len(processed_odds_rows)} odds rows for fixture {fixture_id}.")
-                    else:
-                        # This can happen if the API returns data but the list is empty
-                        logging.info(f"No valid odds found or processed for fixture {fixture_id}.")
-                        fixtures_with_no_odds += 1
-
-                    # Mark fixture as processed regardless of whether odds were found (we attempted it)
-                    total_fixtures_processed += 1
-
-                else:
-                    # Handle cases where client.get might return None due to repeated errors
-                    logging.warning(f"No data returned from API client for fixture {fixture_id} (likely fetch error).")
-                    fixtures_with_errors.append(fixture_id)
-
-                # Store data in batches or at the end
-                if len(processed_odds_batch) >= BATCH_SIZE or (i == num_fixtures - 1 and processed_odds_batch):
-                    logging.info(f"\nStoring batch of {len(processed_odds_batch)} odds rows...")
-                    # Use generic store_data with INSERT OR IGNORE semantics due to UNIQUE constraint
-                    stored_count = store_data(conn, ODDS_TABLE_NAME, processed_odds_batch, primary_key_column="id", use_insert_ignore=True)
-                    total_odds_rows_stored += stored_count
-                    logging.info(f"Finished storing batch. Inserted: {stored_count}")
-                    processed_odds_batch = [] # Reset batch
-
-                # Optional delay
-                if API_DELAY_SECONDS > 0 and i < num_fixtures - 1:
-                    time.sleep(API_DELAY_SECONDS)
-
-            except Exception as e:
-                logging.error(f"Error processing fixture {fixture_id}: {e}", exc_info=True) # Log traceback
-                fixtures_with_errors.append(fixture_id)
-                # Decide if you want to continue or stop on error
+        # Store any remaining rows
+        if processed_odds_batch or raw_batch:
+            total_odds_rows_stored += store_odds_batch(conn, processed_odds_batch, raw_batch)
+            processed_odds_batch.clear()
+            raw_batch.clear()
 
         print("\n--- Sync Summary ---")
         logging.info(f"Fixture IDs targeted: {num_fixtures}")
@@ -202,6 +237,8 @@ def main(limit=FIXTURE_LIMIT): # Accept limit as argument
         logging.critical(f"An unexpected error occurred during the main workflow: {e}", exc_info=True)
     finally:
         if conn:
+            # Also rebuilt by create_fixture_odds_table next run if this fails
+            recreate_indexes(conn, dropped_index_sqls)
             conn.close()
             logging.info("\nDatabase connection closed.")
 
@@ -1,10 +1,10 @@
 # scripts/sync_pressure.py
 import os
 import sys
-import time
-import json
 import sqlite3 # Needed for DB operations
-from pathlib import Path
+import zlib
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 import logging
 
@@ -16,14 +16,17 @@ if project_root_path not in sys.path:
 
 # --- Imports from src ---
 try:
-    from src.api.client import APIClient # Import APIClient directly
-    from src.data.processors import process_pressure_data # Import the new pressure processor
+    from src.api.client import APIClient, RateLimiter # Import APIClient directly
+    from src.data.processors import process_pressure_data, FIXTURE_TIMELINE_PRESSURE_COLUMNS # Import the new pressure processor
     from src.data.storage import (
         get_db_connection,
         create_fixture_timeline_table, # Import function to create the timeline table
-        store_data                 # Use the generic store_data function
+        create_raw_responses_table, # Raw API payloads are kept in the database
+        store_raw_responses,
+        store_rows,                # Insert pre-built row tuples with one executemany
+        drop_secondary_indexes,    # Bulk loads skip secondary index upkeep...
+        recreate_indexes           # ...and rebuild the indexes once at the end
     )
-    from src.config import RAW_DATA_DIR # For saving raw data
 except ImportError as e:
      # Basic logging setup if config/imports fail early
      logging.basicConfig(level=logging.ERROR)
@@ -33,16 +36,13 @@ except ImportError as e:
          # Assuming the script is run from the 'scripts' directory
          # Adjust relative path if necessary
          sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
-         from api.client import APIClient
-         from data.processors import process_pressure_data
-         from data.storage import get_db_connection, create_fixture_timeline_table, store_data
-         # config might be directly accessible if src is in path, try importing directly first
-         try:
-             from config import RAW_DATA_DIR
-         except ImportError:
-             # Fallback if config is not directly accessible
-             # This assumes src is a package and the script is run from scripts/
-             from ..src.config import RAW_DATA_DIR
+         from api.client import APIClient, RateLimiter
+         from data.processors import process_pressure_data, FIXTURE_TIMELINE_PRESSURE_COLUMNS
+         from data.storage import (
+             get_db_connection, create_fixture_timeline_table,
+             create_raw_responses_table, store_raw_responses, store_rows,
+             drop_secondary_indexes, recreate_indexes
+         )
 
          logging.warning("Used adjusted imports as fallback.")
      except ImportError as e_rel:
@@ -56,20 +56,13 @@ except ImportError as e:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
 
 # --- Configuration ---
-# Ensure RAW_DATA_DIR is a Path object if imported directly
-if 'RAW_DATA_DIR' not in locals() or not isinstance(RAW_DATA_DIR, Path):
-     # Fallback if RAW_DATA_DIR wasn't imported correctly
-     logging.warning("RAW_DATA_DIR not found or not a Path object, using fallback relative path.")
-     BASE_DIR = Path(project_root_path) # Use the calculated project root
-     RAW_DATA_DIR = BASE_DIR / "data" / "raw"
-
-
-PRESSURE_RAW_DIR = RAW_DATA_DIR / "fixture_pressure" # Directory for raw pressure responses
-PRESSURE_RAW_DIR.mkdir(parents=True, exist_ok=True)
 # --- Updated Constants ---
-API_DELAY_SECONDS = 1.5 # Increased delay to respect rate limits (3000/hr ~ 1.2s/req)
+MAX_CONCURRENT_REQUESTS = 4 # Pressure requests in flight at once
+MAX_REQUESTS_PER_SECOND = 3000 / 3600 # API plan limit (3000/hr ~ 1.2s/req), shared by all fetch threads; 429s back off via Retry-After
 BATCH_SIZE = 500 # Process and store pressure rows in batches
+RAW_BATCH_SIZE = 50 # Also flush once this many raw responses are pending
 FIXTURE_LIMIT = None # Limit the number of fixtures processed for testing
+BULK_LOAD_MIN_FIXTURES = 1000 # Drop secondary indexes while loading at least this many fixtures
 # --- End Updated Constants ---
 TIMELINE_TABLE_NAME = "fixture_timeline"
 
@@ -87,28 +80,24 @@ def get_fixture_ids_for_pressure(conn, limit=None):
 
     try:
         cursor = conn.cursor()
-        # Select fixture_id from schedules where status is finished
-        # AND the fixture_id does not already exist with event_type='pressure' in fixture_timeline.
-        # Using LEFT JOIN and checking for NULL is generally efficient.
+        # Fixtures that already have pressure rows in fixture_timeline, read once
+        # from ix_timeline_fixture_event into a set
+        cursor.execute(f"SELECT DISTINCT fixture_id FROM {TIMELINE_TABLE_NAME} WHERE event_type = 'pressure'")
+        have_pressure = {row[0] for row in cursor}
+
+        # Select fixture_id from schedules where status is finished (via
+        # ix_schedules_status_start), skipping those in have_pressure in Python
         query = f"""
-            SELECT DISTINCT s.fixture_id
+            SELECT s.fixture_id
             FROM schedules s
-            LEFT JOIN (
-                SELECT DISTINCT fixture_id
-                FROM {TIMELINE_TABLE_NAME}
-                WHERE event_type = 'pressure'
-            ) pt ON s.fixture_id = pt.fixture_id
-            WHERE s.status IN {finished_statuses} AND pt.fixture_id IS NULL
+            WHERE s.status IN ({', '.join('?' for _ in finished_statuses)})
             ORDER BY s.start_time DESC -- Process more recent fixtures first potentially
         """
 
+        cursor.execute(query, finished_statuses)
+        candidates = (row[0] for row in cursor if row[0] not in have_pressure)
         # Apply the limit if provided
-        if limit is not None:
-            query += f" LIMIT {int(limit)}"
-
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        fixture_ids = [row['fixture_id'] for row in rows]
+        fixture_ids = list(islice(candidates, int(limit) if limit is not None else None))
         logging.info(f"Found {len(fixture_ids)} finished fixtures without pressure data (Limit applied: {limit}).")
 
     except sqlite3.Error as e:
@@ -117,9 +106,8 @@ def get_fixture_ids_for_pressure(conn, limit=None):
              logging.info(f"'{TIMELINE_TABLE_NAME}' table not found (will be created), fetching all finished fixtures based on status.")
              try:
                  # Fallback: Fetch all finished fixtures regardless of timeline table presence
-                 fallback_query = f"SELECT fixture_id FROM schedules WHERE status IN {finished_statuses} ORDER BY start_time DESC"
-                 if limit is not None: fallback_query += f" LIMIT {int(limit)}" # Apply limit in fallback too
-                 cursor.execute(fallback_query)
+                 fallback_query = f"SELECT fixture_id FROM schedules WHERE status IN ({', '.join('?' for _ in finished_statuses)}) ORDER BY start_time DESC LIMIT ?"
+                 cursor.execute(fallback_query, (*finished_statuses, int(limit) if limit is not None else -1)) # Apply limit in fallback too
                  rows = cursor.fetchall()
                  fixture_ids = [row['fixture_id'] for row in rows]
                  logging.info(f"Found {len(fixture_ids)} finished fixture IDs (timeline table not present, Limit: {limit}).")
@@ -133,27 +121,36 @@ def get_fixture_ids_for_pressure(conn, limit=None):
             cursor.close()
     return fixture_ids
 
-def save_raw_pressure_data(data, fixture_id):
-    """Saves the raw fixture pressure JSON data."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Ensure PRESSURE_RAW_DIR is a Path object
-    global PRESSURE_RAW_DIR # Allow modification if it wasn't a Path initially
-    if not isinstance(PRESSURE_RAW_DIR, Path):
-        PRESSURE_RAW_DIR = Path(PRESSURE_RAW_DIR)
-    file_path = PRESSURE_RAW_DIR / f"pressure_{fixture_id}_{timestamp}.json"
-    try:
-        save_data = {
-            "fetch_timestamp": datetime.now().isoformat(),
-            "fixture_id": fixture_id,
-            "fixture_data_with_pressure": data # Store the full response
-        }
-        with open(file_path, "w") as f:
-            json.dump(save_data, f, indent=2)
-        logging.debug(f"Saved raw pressure data for fixture {fixture_id} to {file_path}")
-        return file_path
-    except Exception as e:
-        logging.error(f"Error saving raw pressure data for fixture {fixture_id} to {file_path}: {e}")
-        return None
+def fetch_pressure_data(client, rate_limiter, fixture_id):
+    """
+    Fetches the pressure data for one fixture (runs in a worker thread).
+    Returns (parsed JSON, raw_responses row with the compressed response body).
+    """
+    # Construct endpoint for fixture details including pressure
+    endpoint = f"v3/football/fixtures/{fixture_id}?include=pressure"
+    rate_limiter.wait()
+    logging.info(f"Fetching pressure data from: {endpoint}")
+    content, raw_data = client.get_with_content(endpoint)
+    raw_row = (fixture_id, endpoint, datetime.now().isoformat(), zlib.compress(content))
+    return raw_data, raw_row
+
+def store_pressure_batch(conn, rows, raw_rows):
+    """
+    Stores the pending raw responses and a batch of pressure rows in one
+    transaction. Returns the number of pressure rows inserted.
+    """
+    store_raw_responses(conn, raw_rows, commit=not rows)
+    if not rows:
+        return 0
+    logging.info(f"\nStoring batch of {len(rows)} pressure rows into {TIMELINE_TABLE_NAME}...")
+    # INSERT OR IGNORE due to UNIQUE constraint
+    # 'timeline_id' is auto-increment, so it is not among the inserted columns
+    stored_count = store_rows(conn, TIMELINE_TABLE_NAME, FIXTURE_TIMELINE_PRESSURE_COLUMNS, rows, use_insert_ignore=True)
+    if stored_count is not None: # store_rows returns count on success, 0 on failure/no data
+         logging.info(f"Finished storing batch. Inserted/Affected: {stored_count}")
+         return stored_count
+    logging.error(f"Failed to store batch for table {TIMELINE_TABLE_NAME}.")
+    return 0
 
 # --- Main Workflow ---
 def sync_pressure(limit=FIXTURE_LIMIT): # Accept limit as argument
@@ -170,15 +167,18 @@ def sync_pressure(limit=FIXTURE_LIMIT): # Accept limit as argument
         sys.exit(1)
 
     processed_rows_batch = [] # Accumulate processed rows for batch insertion
+    raw_batch = [] # Raw responses stored alongside each batch
     total_fixtures_processed = 0
     total_pressure_rows_stored = 0
     fixtures_with_errors = []
     fixtures_with_no_data = 0
+    dropped_index_sqls = [] # Secondary indexes dropped for a bulk load, restored in finally
 
     try:
         # 1. Ensure Fixture Timeline Table Exists
         logging.info(f"Ensuring database table '{TIMELINE_TABLE_NAME}' exists...")
         create_fixture_timeline_table(conn)
+        create_raw_responses_table(conn)
         # Consider adding update trigger if manual updates to timeline are expected
         # create_update_trigger(conn, TIMELINE_TABLE_NAME, 'timeline_id')
 
@@ -197,86 +197,98 @@ def sync_pressure(limit=FIXTURE_LIMIT): # Accept limit as argument
         # 3. Initialize API Client
         client = APIClient()
         num_fixtures = len(fixture_ids_to_process)
+        rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND, burst=MAX_CONCURRENT_REQUESTS)
         logging.info(f"Attempting to fetch pressure index for {num_fixtures} fixtures...")
 
-        # 4. Loop Through Fixture IDs, Fetch, Process, Store in Batches
-        for i, fixture_id in enumerate(fixture_ids_to_process):
-            # Check if we've already processed the limit (relevant if limit is passed via arg)
-            # This check is technically redundant if get_fixture_ids_for_pressure respects the limit,
-            # but adds safety if the limit logic changes.
-            if effective_limit is not None and i >= effective_limit:
-                 logging.info(f"Reached fixture limit ({effective_limit}). Stopping processing loop.")
-                 break
-
-            logging.info(f"\n--- Processing Fixture ID: {fixture_id} ({i+1}/{num_fixtures}) ---")
-            # Construct endpoint for fixture details including pressure
-            endpoint = f"v3/football/fixtures/{fixture_id}?include=pressure"
+        # 4. Fetch pressure data concurrently (workers also compress the raw
+        #    response); process and store on this thread as each response lands.
+        #    At most max_pending fetches are queued, topped up as they complete.
+        # Slicing to the limit is technically redundant if get_fixture_ids_for_pressure
+        # respects it, but adds safety if the limit logic changes.
+        if effective_limit is not None:
+            fixture_ids_to_process = fixture_ids_to_process[:effective_limit]
+            num_fixtures = len(fixture_ids_to_process)
+        if num_fixtures >= BULK_LOAD_MIN_FIXTURES:
+            # Discovery above is done with ix_timeline_fixture_event; rebuilding it
+            # once is cheaper than updating it on every insert of a large run
+            dropped_index_sqls = drop_secondary_indexes(conn, TIMELINE_TABLE_NAME)
+        fixture_id_iter = iter(fixture_ids_to_process)
+        max_pending = 2 * MAX_CONCURRENT_REQUESTS
+        pending = {}
+        completed = 0
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            def submit_next():
+                fixture_id = next(fixture_id_iter, None)
+                if fixture_id is None:
+                    return False
+                pending[executor.submit(fetch_pressure_data, client, rate_limiter, fixture_id)] = fixture_id
+                return True
+
+            while len(pending) < max_pending and submit_next():
+                pass
+
             try:
-                # Fetch fixture data with pressure include
-                logging.info(f"Fetching pressure data from: {endpoint}")
-                raw_data = client.get(endpoint) # APIClient handles retries internally
-
-                if raw_data and isinstance(raw_data.get('data'), dict): # Check if response is usable
-                    # Optional: Save raw data
-                    save_raw_pressure_data(raw_data, fixture_id)
-
-                    # Process the raw data to extract pressure rows
-                    logging.info(f"Processing pressure data for fixture {fixture_id}...")
-                    processed_pressure_rows = process_pressure_data(raw_data) # Use the specific processor
-
-                    if processed_pressure_rows:
-                        processed_rows_batch.extend(processed_pressure_rows) # Add rows to batch
-                        logging.info(f"Successfully processed {len(processed_pressure_rows)} pressure rows for fixture {fixture_id}.")
-                    else:
-                        # This can happen if the API returns data but the 'pressure' list is empty or invalid
-                        logging.info(f"No valid pressure data found or processed within the response for fixture {fixture_id}.")
-                        fixtures_with_no_data += 1
-
-                    # Mark fixture as processed (we attempted it and got a valid-looking response structure)
-                    total_fixtures_processed += 1
-
-                else:
-                    # Handle cases where client.get might return None (after retries) or invalid structure
-                    logging.warning(f"No valid data dictionary returned from API client for fixture {fixture_id} (endpoint: {endpoint}). Skipping.")
-                    fixtures_with_errors.append(fixture_id)
-                    # Optionally increment fixtures_with_no_data as well if desired
-                    # fixtures_with_no_data +=1
-
-
-                # Store data in batches or at the end (if batch is full or it's the last fixture)
-                # Also store if it's the last iteration within the applied limit
-                is_last_iteration = (i == num_fixtures - 1) or \
-                                    (effective_limit is not None and i == effective_limit - 1)
-
-                if processed_rows_batch and (len(processed_rows_batch) >= BATCH_SIZE or is_last_iteration):
-                    logging.info(f"\nStoring batch of {len(processed_rows_batch)} pressure rows into {TIMELINE_TABLE_NAME}...")
-                    # Use generic store_data with INSERT OR IGNORE due to UNIQUE constraint
-                    # 'timeline_id' is auto-increment, so doesn't need special handling here
-                    stored_count = store_data(conn, TIMELINE_TABLE_NAME, processed_rows_batch, primary_key_column="timeline_id", use_insert_ignore=True)
-                    if stored_count is not None: # store_data returns count on success, 0 or None on failure/no data
-                         total_pressure_rows_stored += stored_count
-                         logging.info(f"Finished storing batch. Inserted/Affected: {stored_count}")
-                    else:
-                         logging.error(f"Failed to store batch for table {TIMELINE_TABLE_NAME}.")
-                    processed_rows_batch = [] # Reset batch
-
-                # Apply API Delay (if not the very last iteration)
-                if API_DELAY_SECONDS > 0 and not is_last_iteration:
-                    logging.debug(f"Waiting {API_DELAY_SECONDS}s before next fixture...")
-                    time.sleep(API_DELAY_SECONDS)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        fixture_id = pending.pop(future)
+                        completed += 1
+                        logging.info(f"\n--- Processing Fixture ID: {fixture_id} ({completed}/{num_fixtures}) ---")
+                        try:
+                            raw_data, raw_row = future.result() # APIClient handles retries internally
+                            raw_batch.append(raw_row) # Keep the raw response
+
+                            if raw_data and isinstance(raw_data.get('data'), dict): # Check if response is usable
+                                # Process the raw data to extract pressure rows
+                                logging.info(f"Processing pressure data for fixture {fixture_id}...")
+                                processed_pressure_rows = process_pressure_data(raw_data) # Use the specific processor
+
+                                if processed_pressure_rows:
+                                    processed_rows_batch.extend(processed_pressure_rows) # Add rows to batch
+                                    logging.info(f"Successfully processed {len(processed_pressure_rows)} pressure rows for fixture {fixture_id}.")
+                                else:
+                                    # This can happen if the API returns data but the 'pressure' list is empty or invalid
+                                    logging.info(f"No valid pressure data found or processed within the response for fixture {fixture_id}.")
+                                    fixtures_with_no_data += 1
+
+                                # Mark fixture as processed (we attempted it and got a valid-looking response structure)
+                                total_fixtures_processed += 1
+
+                            else:
+                                # Handle cases where client.get might return None (after retries) or invalid structure
+                                logging.warning(f"No valid data dictionary returned from API client for fixture {fixture_id}. Skipping.")
+                                fixtures_with_errors.append(fixture_id)
+                                # Optionally increment fixtures_with_no_data as well if desired
+                                # fixtures_with_no_data +=1
+
+                            # Store data in batches (the remainder is stored after the loop)
+                            if len(processed_rows_batch) >= BATCH_SIZE or len(raw_batch) >= RAW_BATCH_SIZE:
+                                total_pressure_rows_stored += store_pressure_batch(conn, processed_rows_batch, raw_batch)
+                                processed_rows_batch.clear() # Reset batches (buffers are reused)
+                                raw_batch.clear()
+
+                        except Exception as e:
+                            logging.error(f"An unexpected error occurred while processing fixture {fixture_id}: {e}", exc_info=True) # Log traceback
+                            fixtures_with_errors.append(fixture_id)
+                            # Decide if you want to continue or stop on error (currently continues)
+
+                        submit_next()
 
             except KeyboardInterrupt:
                  logging.warning("Keyboard interrupt detected. Stopping sync process.")
-                 # Optionally store remaining batch before exiting
-                 if processed_rows_batch:
+                 # Don't start queued fetches; store remaining batch before exiting
+                 for future in pending:
+                     future.cancel()
+                 if processed_rows_batch or raw_batch:
                      logging.info(f"Storing remaining batch of {len(processed_rows_batch)} rows before exiting...")
-                     store_data(conn, TIMELINE_TABLE_NAME, processed_rows_batch, primary_key_column="timeline_id", use_insert_ignore=True)
+                     store_pressure_batch(conn, processed_rows_batch, raw_batch)
                  raise # Re-raise interrupt
 
-            except Exception as e:
-                logging.error(f"An unexpected error occurred while processing fixture {fixture_id}: {e}", exc_info=True) # Log traceback
-                fixtures_with_errors.append(fixture_id)
-                # Decide if you want to continue or stop on error (currently continues)
+        # Store any remaining rows
+        if processed_rows_batch or raw_batch:
+            total_pressure_rows_stored += store_pressure_batch(conn, processed_rows_batch, raw_batch)
+            processed_rows_batch.clear()
+            raw_batch.clear()
 
         print("\n--- Sync Summary ---")
         logging.info(f"Fixture IDs targeted (after limit): {num_fixtures}")
@@ -290,6 +302,8 @@ def sync_pressure(limit=FIXTURE_LIMIT): # Accept limit as argument
         logging.critical(f"An unexpected error occurred during the main workflow: {e}", exc_info=True)
     finally:
         if conn:
+            # Also rebuilt by create_fixture_timeline_table next run if this fails
+            recreate_indexes(conn, dropped_index_sqls)
             conn.close()
             logging.info("\nDatabase connection closed.")
 
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import os
 import sys
-import time
 import json
+import gzip
+import hashlib
 import sqlite3 # Import sqlite3 for error handling
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from datetime import datetime
 import logging # Import logging
@@ -11,14 +13,19 @@ import logging # Import logging
 # Add project root to Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.api.client import APIClient # Import APIClient directly
+from src.api.client import APIClient, RateLimiter # Import APIClient directly
 # Import the NEW detailed processor function
 from src.data.processors import process_schedule_detailed
 from src.data.storage import (
     get_db_connection,
     create_schedules_table, # Import function to create the enhanced schedules table
     create_update_trigger,  # Keep for the schedules table
-    store_data              # Generic storage function
+    store_data,             # Generic storage function
+    create_raw_schedule_hashes_table, # Hash of the last archived response per season
+    load_raw_schedule_hashes,
+    store_raw_schedule_hashes,
+    drop_secondary_indexes, # Bulk loads skip secondary index upkeep...
+    recreate_indexes        # ...and rebuild the indexes once at the end
 )
 from src.config import RAW_DATA_DIR # For saving raw data
 
@@ -28,7 +35,11 @@ from src.config import RAW_DATA_DIR # For saving raw data
 # --- Configuration ---
 SCHEDULES_RAW_DIR = RAW_DATA_DIR / "schedules" # Keep saving raw data here
 SCHEDULES_RAW_DIR.mkdir(parents=True, exist_ok=True)
-API_DELAY_SECONDS = 0.5 # Optional delay between API calls per season (adjust as needed)
+MAX_CONCURRENT_REQUESTS = 4 # Season schedule requests in flight at once
+MAX_REQUESTS_PER_SECOND = 2 # Request rate cap for season schedule calls, shared by all fetch threads (adjust as needed)
+RAW_GZIP_LEVEL = 3 # Fast gzip level for raw archives
+COMMIT_EVERY_SEASONS = 50 # Seasons stored per transaction (one journal sync each)
+BULK_LOAD_MIN_SEASONS = 15 # Drop secondary schedules indexes when syncing at least this many seasons (~5000+ fixtures)
 
 # --- Helper Functions ---
 def get_season_ids_from_db(conn):
@@ -41,8 +52,7 @@ def get_season_ids_from_db(conn):
         # Fetching only current or unfinished might be more efficient
         cursor.execute("SELECT season_id FROM seasons WHERE finished = 0 OR is_current = 1 ORDER BY season_id;")
         # cursor.execute("SELECT season_id FROM seasons ORDER BY season_id;") # Or fetch all
-        rows = cursor.fetchall()
-        season_ids = [row['season_id'] for row in rows]
+        season_ids = [row[0] for row in cursor] # Positional: no fetchall list or by-name lookup
         logging.info(f"Found {len(season_ids)} season IDs in the database to process.")
     except sqlite3.Error as e:
         logging.error(f"Error fetching season IDs from database: {e}")
@@ -54,24 +64,49 @@ def get_season_ids_from_db(conn):
             cursor.close()
     return season_ids
 
-def save_raw_schedule(data, season_id):
-    """Saves the raw schedule JSON data."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_path = SCHEDULES_RAW_DIR / f"schedule_{season_id}_{timestamp}.json"
+def save_raw_schedule(content, season_id):
+    """
+    Saves the raw schedule response as gzipped JSON. content is the response body
+    as received; it is spliced into the archive envelope as-is rather than
+    re-serialized from the parsed dict.
+    """
+    fetched_at = datetime.now() # One clock read for both the file name and the envelope
+    timestamp = fetched_at.strftime("%Y%m%d_%H%M%S")
+    file_path = SCHEDULES_RAW_DIR / f"schedule_{season_id}_{timestamp}.json.gz"
     try:
-        save_data = {
-            "fetch_timestamp": datetime.now().isoformat(),
-            "season_id": season_id,
-            "schedule_data": data
-        }
-        with open(file_path, "w") as f:
-            json.dump(save_data, f, indent=2)
-        logging.debug(f"Saved raw schedule for season {season_id} to {file_path}")
+        # Same envelope as before: {"fetch_timestamp", "season_id", "schedule_data": <full response>}
+        header = json.dumps({"fetch_timestamp": fetched_at.isoformat(), "season_id": season_id}, separators=(",", ":"))
+        with gzip.open(file_path, "wb", compresslevel=RAW_GZIP_LEVEL) as f:
+            f.write(header[:-1].encode("utf-8") + b',"schedule_data":' + content + b"}")
+        logging.debug("Saved raw schedule for season %s to %s", season_id, file_path) # Lazy: formatted only if DEBUG is on
         return file_path
     except Exception as e:
         logging.error(f"Error saving raw schedule for season {season_id} to {file_path}: {e}")
         return None
 
+def fetch_season_schedule(client, rate_limiter, season_id, archived_hashes):
+    """
+    Fetches (and archives) the schedule for one season (runs in a worker thread).
+    The response is only archived if it differs from the last archived one
+    (archived_hashes: {season_id: sha1}, read-only here).
+    Returns (parsed JSON or None, (season_id, sha1, path) for a new archive or None).
+    """
+    endpoint = f"v3/football/schedules/seasons/{season_id}"
+    rate_limiter.wait() # Only sleeps if the rate cap has been reached
+    logging.info(f"Fetching schedule from: {endpoint}")
+    content, raw_data = client.get_with_content(endpoint) # Using APIClient directly
+    archived = None
+    if raw_data:
+        # Optional: Save raw data (the body as received), skipping unchanged responses
+        digest = hashlib.sha1(content).hexdigest()
+        if archived_hashes.get(season_id) == digest:
+            logging.debug("Schedule for season %s unchanged since last archive; not saved again.", season_id)
+        else:
+            file_path = save_raw_schedule(content, season_id)
+            if file_path:
+                archived = (season_id, digest, str(file_path))
+    return raw_data, archived
+
 # --- Main Workflow ---
 def main():
     """Fetches schedules for each season, processes detailed fixture info, and stores them."""
@@ -84,11 +119,15 @@ def main():
         logging.critical("Failed to connect to the database. Exiting.")
         sys.exit(1)
 
+    dropped_index_sqls = [] # Secondary indexes dropped for a bulk load, restored in finally
+
     try:
         # 1. Ensure Schedules Table Exists (with the new structure)
         logging.info(f"Ensuring database table '{schedules_table_name}' exists...")
         create_schedules_table(conn) # Calls the function with the new schema
         create_update_trigger(conn, schedules_table_name, schedules_primary_key)
+        create_raw_schedule_hashes_table(conn)
+        archived_hashes = load_raw_schedule_hashes(conn)
 
         # 2. Get Season IDs to Fetch
         season_ids = get_season_ids_from_db(conn)
@@ -103,49 +142,78 @@ def main():
         seasons_processed_count = 0
         seasons_with_errors = []
 
-        # 4. Loop Through Seasons, Fetch, Process, Store
+        # 4. Fetch seasons concurrently; process and store on this thread as each
+        #    response lands. At most max_pending fetches are queued, topped up as
+        #    they complete.
         num_seasons = len(season_ids)
-        for i, season_id in enumerate(season_ids):
-            logging.info(f"\n--- Processing Season ID: {season_id} ({i+1}/{num_seasons}) ---")
-            endpoint = f"v3/football/schedules/seasons/{season_id}"
-            try:
-                # Fetch schedule data for the current season
-                logging.info(f"Fetching schedule from: {endpoint}")
-                raw_data = client.get(endpoint) # Using APIClient directly
-
-                if raw_data:
-                    # Optional: Save raw data
-                    save_raw_schedule(raw_data, season_id)
-
-                    # Process the raw data using the NEW detailed processor
-                    logging.info(f"Processing detailed schedule data for season {season_id}...")
-                    # *** USE THE NEW PROCESSOR HERE ***
-                    processed_schedule_entries = process_schedule_detailed(raw_data)
-                    entries_count = len(processed_schedule_entries)
-                    total_schedule_entries_processed += entries_count
-                    logging.info(f"Found {entries_count} detailed fixture entries for season {season_id}.")
-
-                    # Store the processed entries
-                    if processed_schedule_entries:
-                        logging.info(f"Storing {entries_count} schedule entries into '{schedules_table_name}'...")
-                        # Use generic store_data with fixture_id as PK (will replace if fixture appears again)
-                        stored_count = store_data(conn, schedules_table_name, processed_schedule_entries, schedules_primary_key)
-                        total_schedule_entries_stored += stored_count
-                        logging.info(f"Finished storing schedule entries for season {season_id}. Stored/Updated: {stored_count}")
-                    else:
-                        logging.info(f"No valid schedule entries processed for season {season_id}.")
-                else:
-                    logging.warning(f"No data returned from API for season {season_id}.")
-
-                seasons_processed_count += 1
-                # Optional delay
-                if API_DELAY_SECONDS > 0 and i < num_seasons - 1:
-                    logging.debug(f"Waiting {API_DELAY_SECONDS}s before next season...")
-                    time.sleep(API_DELAY_SECONDS)
-
-            except Exception as e:
-                logging.error(f"Error processing season {season_id}: {e}", exc_info=True) # Log traceback
-                seasons_with_errors.append(season_id)
+        if num_seasons >= BULK_LOAD_MIN_SEASONS:
+            # INSERT OR REPLACE updates ix_schedules_status_start for every row;
+            # rebuilding it once is cheaper on a large sync
+            dropped_index_sqls = drop_secondary_indexes(conn, schedules_table_name)
+        rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND, burst=MAX_CONCURRENT_REQUESTS)
+        season_id_iter = iter(season_ids)
+        max_pending = 2 * MAX_CONCURRENT_REQUESTS
+        pending = {}
+        completed = 0
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            def submit_next():
+                season_id = next(season_id_iter, None)
+                if season_id is None:
+                    return False
+                pending[executor.submit(fetch_season_schedule, client, rate_limiter, season_id, archived_hashes)] = season_id
+                return True
+
+            while len(pending) < max_pending and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    season_id = pending.pop(future)
+                    completed += 1
+                    logging.info(f"\n--- Processing Season ID: {season_id} ({completed}/{num_seasons}) ---")
+                    try:
+                        raw_data, archived = future.result()
+                        if archived:
+                            # Committed with the season's schedule rows below
+                            store_raw_schedule_hashes(conn, [archived], commit=False)
+
+                        if raw_data:
+                            # Process the raw data using the NEW detailed processor
+                            logging.info(f"Processing detailed schedule data for season {season_id}...")
+                            # *** USE THE NEW PROCESSOR HERE ***
+                            processed_schedule_entries = process_schedule_detailed(raw_data)
+                            entries_count = len(processed_schedule_entries)
+                            total_schedule_entries_processed += entries_count
+                            logging.info(f"Found {entries_count} detailed fixture entries for season {season_id}.")
+
+                            # Store the processed entries
+                            if processed_schedule_entries:
+                                logging.info(f"Storing {entries_count} schedule entries into '{schedules_table_name}'...")
+                                # Use generic store_data with fixture_id as PK (will replace if fixture appears again);
+                                # committed with the surrounding seasons below
+                                stored_count = store_data(conn, schedules_table_name, processed_schedule_entries,
+                                                          schedules_primary_key, commit=False)
+                                if stored_count is None: # Details logged by store_data; the season's rows were undone
+                                    raise RuntimeError(f"Storing schedule entries for season {season_id} failed")
+                                total_schedule_entries_stored += stored_count
+                                logging.info(f"Finished storing schedule entries for season {season_id}. Stored/Updated: {stored_count}")
+                            else:
+                                logging.info(f"No valid schedule entries processed for season {season_id}.")
+                        else:
+                            logging.warning(f"No data returned from API for season {season_id}.")
+
+                        seasons_processed_count += 1
+
+                    except Exception as e:
+                        logging.error(f"Error processing season {season_id}: {e}", exc_info=True) # Log traceback
+                        seasons_with_errors.append(season_id)
+
+                    if completed % COMMIT_EVERY_SEASONS == 0:
+                        conn.commit()
+                    submit_next()
+
+        conn.commit() # Remaining seasons
 
         logging.info("\n--- Sync Summary ---")
         logging.info(f"Seasons processed: {seasons_processed_count}/{num_seasons}")
@@ -158,12 +226,14 @@ def main():
         logging.critical(f"An unexpected error occurred during the main workflow: {e}", exc_info=True)
     finally:
         if conn:
+            # Also rebuilt by create_schedules_table next run if this fails
+            recreate_indexes(conn, dropped_index_sqls)
             conn.close()
             logging.info("\nDatabase connection closed.")
 
     logging.info("=== Enhanced Schedule Sync Workflow Completed ===")
 
 if __name__ == "__main__":
-    # Setup logging (optional, if not configured globally)
-    # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Setup logging (otherwise INFO progress is formatted and then dropped)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     main()
@@ -42,8 +42,8 @@ def main():
 
     # 2. Process Data
     print(f"Processing fetched {resource_name} data...")
-    processed_data = [process_team_data(item) for item in all_raw_data]
-    processed_data = [p for p in processed_data if p is not None] # Filter out None values
+    # One pass: process and drop None results without an intermediate list
+    processed_data = [p for p in map(process_team_data, all_raw_data) if p is not None]
     print(f"Successfully processed {len(processed_data)} {resource_name}.")
 
     if not processed_data:
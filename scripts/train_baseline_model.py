@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
 import os
 import sys
+import importlib.util
 import pandas as pd
 import numpy as np # Import numpy
 from pathlib import Path
 import logging
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score, log_loss, confusion_matrix
+from sklearn.model_selection import StratifiedShuffleSplit
+from sklearn.metrics import roc_auc_score, log_loss
 import lightgbm as lgb
-import matplotlib.pyplot as plt # For plotting
-import seaborn as sns # For plotting
+
+# Optional: with pyarrow installed pandas parses the CSV with the multithreaded Arrow reader
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
 
 # Add project root to Python path to allow importing from src
 project_root = Path(__file__).resolve().parent.parent
@@ -30,6 +32,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 # --- !!! UPDATED FILENAME !!! ---
 INPUT_FILENAME = "ml_predictors_target_2H_AH0_5_odds_feat_dataset.csv"
+PARQUET_INPUT_FILENAME = "ml_predictors_target_2H_AH0_5_odds_feat_dataset.parquet" # Written next to the CSV by build_ml_dataset when pyarrow is installed
 TARGET_AH_LINE = -0.5 # Must match the value in build_ml_dataset script
 TARGET_COLUMN = f'target_fav_covers_ah_{str(TARGET_AH_LINE).replace(".","_").replace("-","neg")}_2H'
 
@@ -47,6 +50,10 @@ FEATURE_COLUMNS = [
 ]
 # --- End Updates ---
 
+# PNG plots (confusion matrix, feature importance); PLOTS=0 skips them, and the
+# matplotlib/seaborn imports, e.g. for parameter sweeps
+PLOTS_ENABLED = os.environ.get("PLOTS", "1") != "0"
+
 # Model Training Parameters
 TEST_SIZE = 0.2 # Fraction of data for testing
 RANDOM_STATE = 42 # For reproducibility of train/test split
@@ -56,18 +63,26 @@ LGB_PARAMS = {
     'objective': 'binary',
     'metric': 'binary_logloss',
     'boosting_type': 'gbdt',
+    'data_sample_strategy': 'goss', # Gradient-based one-side sampling: keeps large-gradient rows, samples the rest
+    'top_rate': 0.2,
+    'other_rate': 0.1,
     'num_leaves': 31,
     'learning_rate': 0.05,
     'feature_fraction': 0.9,
+    'num_threads': os.cpu_count() or 1,
+    'max_bin': 63, # Ample for the count differentials and ratios used here; narrower histograms
+    'min_data_in_bin': 20,
+    'force_row_wise': True, # Few features: row-wise histograms, and skips LightGBM's layout auto-test
     'seed': RANDOM_STATE,
     'verbose': -1
 }
 
-def plot_confusion_matrix(cm, classes, normalize=False, title='Confusion matrix', cmap=plt.cm.Blues):
+def plot_confusion_matrix(cm, classes, normalize=False, title='Confusion matrix', cmap='Blues'):
     """
     This function prints and plots the confusion matrix.
     Normalization can be applied by setting `normalize=True`.
     """
+    import matplotlib.pyplot as plt # Imported only when plotting
     if normalize:
         cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
         logging.info("Normalized confusion matrix")
@@ -76,8 +91,17 @@ def plot_confusion_matrix(cm, classes, normalize=False, title='Confusion matrix'
 
     logging.info(f"\n{cm}")
 
-    plt.figure(figsize=(8, 6))
-    sns.heatmap(cm, annot=True, fmt=".2f" if normalize else "d", cmap=cmap, xticklabels=classes, yticklabels=classes)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    image = ax.imshow(cm, cmap=cmap)
+    fig.colorbar(image, ax=ax)
+    ax.set_xticks(range(len(classes)), labels=classes)
+    ax.set_yticks(range(len(classes)), labels=classes)
+    # Annotate each cell, in white on the darker half of the colour scale
+    threshold = (cm.max() + cm.min()) / 2
+    for i in range(cm.shape[0]):
+        for j in range(cm.shape[1]):
+            ax.text(j, i, f"{cm[i, j]:.2f}" if normalize else f"{cm[i, j]:d}", ha="center", va="center",
+                    color="white" if cm[i, j] > threshold else "black")
     plt.title(title)
     plt.ylabel('True label')
     plt.xlabel('Predicted label')
@@ -88,20 +112,58 @@ def plot_confusion_matrix(cm, classes, normalize=False, title='Confusion matrix'
     plt.close()
 
 
+def plot_feature_importance(importance_df):
+    """Plots the top features by gain and saves the figure as a PNG."""
+    import matplotlib.pyplot as plt # Imported only when plotting
+
+    plt.figure(figsize=(10, 8)) # Adjusted figure size for more features
+    # Plot more features if available
+    num_features_to_plot = min(len(FEATURE_COLUMNS), 20)
+    top_features = importance_df.head(num_features_to_plot)[::-1] # barh draws bottom-up; largest on top
+    plt.barh(top_features['feature'], top_features['importance'])
+    plt.xlabel('importance')
+    plt.title(f"LGBM Feature Importance (Gain) - Target: {TARGET_COLUMN}, Odds Feat")
+    plt.tight_layout()
+    importance_plot_filename = f"feature_importance_{TARGET_COLUMN}_oddsfeat.png" # Updated plot filename
+    plt.savefig(importance_plot_filename)
+    logging.info(f"Feature importance plot saved to {importance_plot_filename}")
+    plt.close()
+
+def load_dataset(input_path, parquet_path):
+    """
+    Loads the feature and target columns of the dataset, from the Parquet copy
+    when it exists and is not older than the CSV, otherwise from the CSV.
+    """
+    if parquet_path.exists() and (not input_path.exists() or parquet_path.stat().st_mtime >= input_path.stat().st_mtime):
+        try:
+            logging.info(f"Loading dataset from: {parquet_path}")
+            return pd.read_parquet(parquet_path, columns=FEATURE_COLUMNS + [TARGET_COLUMN])
+        except Exception as e:
+            if not input_path.exists():
+                raise
+            logging.warning(f"Could not read Parquet dataset ({e}). Falling back to CSV.")
+    logging.info(f"Loading dataset from: {input_path}")
+    # Parse only the model's columns (features as float32); absent ones are
+    # left out here and reported by the column check in train_baseline
+    header = pd.read_csv(input_path, nrows=0).columns
+    usecols = [col for col in FEATURE_COLUMNS + [TARGET_COLUMN] if col in header]
+    dtypes = {col: np.float32 for col in FEATURE_COLUMNS if col in header}
+    return pd.read_csv(input_path, usecols=usecols, dtype=dtypes, engine=CSV_ENGINE)
+
 def train_baseline():
     """Loads data, trains a baseline LightGBM model using odds features, and evaluates it."""
     logging.info(f"=== Starting Baseline Model Training (Target: {TARGET_COLUMN}, Incl. Odds Features) ===")
 
     # 1. Load Data
     input_path = PROCESSED_DATA_DIR / INPUT_FILENAME
-    if not input_path.exists():
+    parquet_path = PROCESSED_DATA_DIR / PARQUET_INPUT_FILENAME
+    if not input_path.exists() and not parquet_path.exists():
         logging.error(f"Input dataset not found: {input_path}")
         logging.error("Please run the updated build_ml_dataset script first.")
         sys.exit(1)
 
-    logging.info(f"Loading dataset from: {input_path}")
     try:
-        df = pd.read_csv(input_path)
+        df = load_dataset(input_path, parquet_path)
         logging.info(f"Dataset loaded successfully with {len(df)} rows.")
     except Exception as e:
         logging.error(f"Error loading dataset: {e}")
@@ -117,17 +179,20 @@ def train_baseline():
         sys.exit(1)
 
     # Handle potential infinite or NaN values in features (important for odds calculations)
-    df.replace([np.inf, -np.inf], np.nan, inplace=True)
-    if df[FEATURE_COLUMNS].isnull().any().any():
-        missing_cols_report = df[FEATURE_COLUMNS].isnull().sum()
+    # One float32 pass over the feature columns only: report, then zero NaN/inf in place
+    # (float32 halves the bytes the split and LightGBM's binning pass read)
+    features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float32, copy=True) # Own, writable buffer
+    non_finite = ~np.isfinite(features)
+    if non_finite.any():
+        missing_cols_report = pd.Series(non_finite.sum(axis=0), index=FEATURE_COLUMNS)
         missing_cols_report = missing_cols_report[missing_cols_report > 0]
         logging.warning(f"NaN/Infinite values found in feature columns after loading. Imputing with 0.\n{missing_cols_report}")
         # Consider more sophisticated imputation, especially for odds, if this happens frequently
-        df[FEATURE_COLUMNS] = df[FEATURE_COLUMNS].fillna(0)
+        np.nan_to_num(features, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
 
 
     # 2. Prepare Features (X) and Target (y)
-    X = df[FEATURE_COLUMNS]
+    X = features # float32 matrix, columns in FEATURE_COLUMNS order
     y = df[TARGET_COLUMN]
 
     logging.info(f"Features shape: {X.shape}")
@@ -135,29 +200,35 @@ def train_baseline():
     logging.info(f"Target distribution (0 = No Cover 2H AH {TARGET_AH_LINE}, 1 = Cover 2H AH {TARGET_AH_LINE}):\n{y.value_counts(normalize=True)}")
 
     # 3. Split Data into Training and Testing sets
+    # Stratified row indices, then one fancy-index copy per side of the array
+    # (the same split train_test_split(stratify=y) draws, without DataFrame copies)
     logging.info(f"Splitting data into training ({1-TEST_SIZE:.0%}) and testing ({TEST_SIZE:.0%})...")
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y,
-        test_size=TEST_SIZE,
-        random_state=RANDOM_STATE,
-        stratify=y
-    )
+    y = y.to_numpy()
+    splitter = StratifiedShuffleSplit(n_splits=1, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+    train_idx, test_idx = next(splitter.split(np.zeros(len(y)), y))
+    X_train, X_test, y_train, y_test = X[train_idx], X[test_idx], y[train_idx], y[test_idx]
     logging.info(f"Train set size: {len(X_train)}, Test set size: {len(X_test)}")
 
     # 4. Train LightGBM Model
     logging.info("Training LightGBM baseline model with odds features...")
-    lgb_train = lgb.Dataset(X_train, y_train)
-    lgb_eval = lgb.Dataset(X_test, y_test, reference=lgb_train)
+    # Build the binned datasets up front; with free_raw_data LightGBM drops its
+    # raw copy, and the arrays only the split needed go too. The binning params
+    # (max_bin, min_data_in_bin) must be given here, as they are fixed once constructed
+    lgb_train = lgb.Dataset(X_train, y_train, feature_name=FEATURE_COLUMNS,
+                            params=LGB_PARAMS, free_raw_data=True).construct()
+    lgb_eval = lgb.Dataset(X_test, y_test, feature_name=FEATURE_COLUMNS, params=LGB_PARAMS,
+                           reference=lgb_train, free_raw_data=True).construct()
+    del df, X, features, X_train # X_test stays for the evaluation below
 
     model = lgb.train(
         LGB_PARAMS,
         lgb_train,
         num_boost_round=500,
-        valid_sets=[lgb_train, lgb_eval],
-        valid_names=['train', 'eval'],
-        callbacks=[lgb.early_stopping(stopping_rounds=50, verbose=True)]
+        valid_sets=[lgb_eval], # Only the held-out set is scored each round
+        valid_names=['eval'],
+        callbacks=[lgb.early_stopping(stopping_rounds=50, verbose=False), lgb.log_evaluation(period=50)]
     )
-    logging.info("Model training completed.")
+    logging.info(f"Model training completed. Best iteration: {model.best_iteration}")
 
     model_filename = f"baseline_lgbm_model_{TARGET_COLUMN}_oddsfeat.txt" # Updated model filename
     try:
@@ -169,15 +240,19 @@ def train_baseline():
 
     # 5. Evaluate Model on the Test Set
     logging.info("Evaluating model on the unseen test set...")
-    y_pred_proba = model.predict(X_test, num_iteration=model.best_iteration)
-    y_pred = (y_pred_proba > 0.5).astype(int)
-
-    accuracy = accuracy_score(y_test, y_pred)
-    precision = precision_score(y_test, y_pred, zero_division=0)
-    recall = recall_score(y_test, y_pred, zero_division=0)
+    # X_test is the float32 ndarray (no DataFrame conversion inside predict)
+    y_pred_proba = model.predict(X_test, num_iteration=model.best_iteration, num_threads=LGB_PARAMS['num_threads'])
+    y_pred = (y_pred_proba > 0.5).astype(np.int8)
+
+    # Threshold metrics from one 2x2 confusion count ([[tn, fp], [fn, tp]]);
+    # precision/recall are 0 when undefined, like zero_division=0
+    cm = np.bincount(2 * (y_test == 1) + y_pred, minlength=4).reshape(2, 2)
+    (tn, fp), (fn, tp) = cm
+    accuracy = (tp + tn) / len(y_test)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
     auc = roc_auc_score(y_test, y_pred_proba)
     logloss = log_loss(y_test, y_pred_proba)
-    cm = confusion_matrix(y_test, y_pred)
 
     logging.info(f"--- Test Set Evaluation Metrics ({TARGET_COLUMN}, Incl. Odds Features) ---")
     logging.info(f"Accuracy:  {accuracy:.4f}")
@@ -187,7 +262,10 @@ def train_baseline():
     logging.info(f"Log Loss:  {logloss:.4f}")
     logging.info("--------------------------------------------------------------------")
 
-    plot_confusion_matrix(cm, classes=[f'No Cover 2H AH {TARGET_AH_LINE}', f'Cover 2H AH {TARGET_AH_LINE}'], title=f'Confusion Matrix ({TARGET_COLUMN}, Odds Feat)')
+    if PLOTS_ENABLED:
+        plot_confusion_matrix(cm, classes=[f'No Cover 2H AH {TARGET_AH_LINE}', f'Cover 2H AH {TARGET_AH_LINE}'], title=f'Confusion Matrix ({TARGET_COLUMN}, Odds Feat)')
+    else:
+        logging.info(f"Confusion matrix:\n{cm}")
 
 
     # 6. Feature Importance
@@ -201,16 +279,8 @@ def train_baseline():
         logging.info("Top Feature Importances (Gain):")
         print(importance_df.head(len(FEATURE_COLUMNS)).to_string(index=False)) # Print all features
 
-        plt.figure(figsize=(10, 8)) # Adjusted figure size for more features
-        # Plot more features if available
-        num_features_to_plot = min(len(FEATURE_COLUMNS), 20)
-        sns.barplot(x="importance", y="feature", data=importance_df.head(num_features_to_plot))
-        plt.title(f"LGBM Feature Importance (Gain) - Target: {TARGET_COLUMN}, Odds Feat")
-        plt.tight_layout()
-        importance_plot_filename = f"feature_importance_{TARGET_COLUMN}_oddsfeat.png" # Updated plot filename
-        plt.savefig(importance_plot_filename)
-        logging.info(f"Feature importance plot saved to {importance_plot_filename}")
-        plt.close()
+        if PLOTS_ENABLED:
+            plot_feature_importance(importance_df)
 
     except Exception as e:
         logging.warning(f"Could not calculate or plot feature importance: {e}")
@@ -1,60 +1,143 @@
 import requests
 import time
 import json
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.utils.json_io import parse_json
 from src.config import API_KEY, API_BASE_URL, REQUEST_TIMEOUT, MAX_RETRIES, RETRY_BACKOFF_FACTOR
 
+class RateLimiter:
+    """
+    Token bucket (shared across threads): calls refill at max_per_second and up
+    to burst calls may go out back to back after an idle spell. burst=1 simply
+    spaces calls 1/max_per_second apart.
+    """
+
+    def __init__(self, max_per_second, burst=1):
+        self.rate = max_per_second if max_per_second and max_per_second > 0 else 0.0
+        self.capacity = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.capacity)
+        self._last_time = time.monotonic()
+
+    def wait(self):
+        """Block until the caller may make its next call (only if the bucket is empty)."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_time) * self.rate)
+            self._last_time = now
+            # Take a token now; a negative balance is the queue of callers
+            # already waiting for future tokens
+            self._tokens -= 1
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait_time > 0:
+            time.sleep(wait_time)
+
 class APIClient:
     """Base client for the SportMonks API."""
-    
+
+    # Connection pool size per host; matches the largest fetch thread pools
+    POOL_SIZE = 20
+    # Transient statuses retried by the transport; a 429/503 Retry-After header
+    # sets the wait before the retry instead of the backoff schedule
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # Pause all requests until the quota resets once the API reports this few
+    # calls left (SportMonks returns a "rate_limit" block in each response body)
+    RATE_LIMIT_LOW_WATERMARK = 5
+
     def __init__(self):
         self.base_url = API_BASE_URL
         self.headers = {
             "Accept": "application/json"
         }
-    
+        # One pooled keep-alive session for every request made by this client,
+        # so TCP/TLS setup is paid once per connection rather than per call.
+        # Retries with exponential backoff are handled by the transport adapter.
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=RETRY_BACKOFF_FACTOR,
+            status_forcelist=self.RETRY_STATUS_CODES,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Monotonic time before which no request is sent (quota nearly used up)
+        self._quota_lock = threading.Lock()
+        self._quota_resume_at = 0.0
+
+    def _wait_for_quota(self):
+        """Sleeps only while a reported quota reset is still pending."""
+        with self._quota_lock:
+            delay = self._quota_resume_at - time.monotonic()
+        if delay > 0:
+            print(f"API quota nearly used up; pausing {delay:.1f}s until it resets.")
+            time.sleep(delay)
+
+    def _note_rate_limit(self, data):
+        """Records the quota reset time from the response's rate_limit block, if low."""
+        rate_limit = data.get("rate_limit") if isinstance(data, dict) else None
+        if not isinstance(rate_limit, dict):
+            return
+        remaining = rate_limit.get("remaining")
+        resets_in = rate_limit.get("resets_in_seconds")
+        if remaining is None or resets_in is None or remaining > self.RATE_LIMIT_LOW_WATERMARK:
+            return
+        with self._quota_lock:
+            self._quota_resume_at = max(self._quota_resume_at, time.monotonic() + resets_in)
+
     def get(self, endpoint, params=None):
-        """Make a GET request to the API with retry logic."""
+        """Make a GET request to the API (retries are handled by the session adapter)."""
+        return self.get_with_content(endpoint, params)[1]
+
+    def get_with_content(self, endpoint, params=None):
+        """
+        Like get(), but returns (raw response bytes, parsed JSON) so callers that
+        archive the response can write the body as received instead of
+        re-serializing the parsed dict.
+        """
         url = f"{self.base_url}/{endpoint}"
-        
+
         # Initialize params if None
         if params is None:
             params = {}
-        
+
         # Add API token to parameters per SportMonks docs
         params["api_token"] = API_KEY
-        
-        for attempt in range(MAX_RETRIES):
+
+        self._wait_for_quota()
+        print(f"Making request to: {url}")
+        print(f"Parameters: {params}")
+        try:
+            response = self.session.get(
+                url,
+                params=params,
+                timeout=(5, REQUEST_TIMEOUT),
+                verify=True
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"Request failed after {MAX_RETRIES} retries: {e}")
+            raise
+
+        # Log the response status
+        print(f"Response status: {response.status_code}")
+
+        # For debugging: if there's an error, print the response content
+        if response.status_code >= 400:
             try:
-                print(f"Making request to: {url}")
-                print(f"Parameters: {params}")
-                
-                response = requests.get(
-                    url, 
-                    headers=self.headers, 
-                    params=params,
-                    timeout=REQUEST_TIMEOUT,
-                    verify=True
-                )
-                
-                # Log the response status
-                print(f"Response status: {response.status_code}")
-                
-                # For debugging: if there's an error, print the response content
-                if response.status_code >= 400:
-                    try:
-                        error_details = response.json()
-                        print(f"Error details: {json.dumps(error_details, indent=2)}")
-                    except:
-                        print(f"Raw error response: {response.text}")
-                
-                response.raise_for_status()
-                return response.json()
-                
-            except requests.exceptions.RequestException as e:
-                if attempt < MAX_RETRIES - 1:
-                    wait_time = RETRY_BACKOFF_FACTOR ** attempt
-                    print(f"Request failed: {e}. Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"Failed after {MAX_RETRIES} attempts.")
-                    raise
\ No newline at end of file
+                error_details = response.json()
+                print(f"Error details: {json.dumps(error_details, indent=2)}")
+            except ValueError:
+                print(f"Raw error response: {response.text}")
+
+        response.raise_for_status()
+        content = response.content
+        data = parse_json(content)
+        self._note_rate_limit(data)
+        return content, data
@@ -1,9 +1,9 @@
-import json
 import time
 from datetime import datetime
 from pathlib import Path
 from src.api.client import APIClient
 from src.config import RAW_DATA_DIR
+from src.utils.json_io import write_json
 
 class EndpointHandler:
     """Generic handler for any SportMonks API endpoint."""
@@ -174,8 +174,7 @@ class EndpointHandler:
         file_path = self.resource_dir / f"{self.resource_name}_page_{page}_{timestamp}.json"
 
         try:
-            with open(file_path, "w") as f:
-                json.dump(data, f, indent=2)
+            write_json(file_path, data, indent=False) # Compact: raw archive, not read by hand
             # print(f"Saved page {page} raw data to {file_path}") # Optional log
             return file_path
         except Exception as e:
@@ -197,21 +196,19 @@ class EndpointHandler:
         metadata_path = self.resource_dir / f"{self.resource_name}_{timestamp}_metadata.json"
 
         try:
-            with open(file_path, "w") as f:
-                json.dump(data, f, indent=2)
+            write_json(file_path, data, indent=False) # Compact: raw archive, not read by hand
         except Exception as e:
              print(f"Error saving consolidated data to {file_path}: {e}")
              # Decide if you want to raise the error or just return None
              # raise
 
         try:
-            with open(metadata_path, "w") as f:
-                # Convert Path objects to strings for JSON serialization
-                if "file_path" in metadata:
-                    metadata["file_path"] = str(metadata["file_path"])
-                if "metadata_path" in metadata:
-                     metadata["metadata_path"] = str(metadata["metadata_path"])
-                json.dump(metadata, f, indent=2)
+            # Convert Path objects to strings for JSON serialization
+            if "file_path" in metadata:
+                metadata["file_path"] = str(metadata["file_path"])
+            if "metadata_path" in metadata:
+                 metadata["metadata_path"] = str(metadata["metadata_path"])
+            write_json(metadata_path, metadata)
         except Exception as e:
             print(f"Error saving metadata to {metadata_path}: {e}")
             # Decide if you want to raise the error or just return None
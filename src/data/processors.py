@@ -2,6 +2,7 @@
 from datetime import datetime
 import logging
 import json # Needed for handling participants field
+import pandas as pd # Batch (column-wise) processors
 
 # Configure basic logging if not done elsewhere
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -70,6 +71,43 @@ def process_league_data(raw_league_data):
         return None
     return processed
 
+# Raw API fields copied straight into the leagues table ('id' becomes 'league_id')
+LEAGUE_API_FIELDS = [
+    "id", "sport_id", "country_id", "name", "active", "short_code", "image_path",
+    "type", "sub_type", "last_played_at", "category"
+]
+
+def process_league_data_batch(raw_leagues):
+    """
+    Batch version of process_league_data: projects a whole list of raw league
+    items column-wise with pandas instead of rebuilding one dict per item.
+    Returns the same list of row dictionaries (invalid items are skipped).
+    """
+    valid_items = [item for item in raw_leagues if item and isinstance(item, dict)]
+    if len(valid_items) < len(raw_leagues):
+        logging.warning(f"Skipping {len(raw_leagues) - len(valid_items)} invalid raw league items.")
+    if not valid_items:
+        return []
+
+    # dtype=object keeps ints as ints (no float upcast around missing values)
+    df = pd.DataFrame(valid_items, columns=LEAGUE_API_FIELDS + ["currentseason"], dtype=object)
+    df = df.rename(columns={"id": "league_id"})
+    df["current_season_id"] = pd.Series(
+        [season.get("id") if isinstance(season, dict) else None for season in df["currentseason"]],
+        index=df.index, dtype=object
+    )
+    df = df.drop(columns="currentseason")
+
+    # Basic validation (same rule as process_league_data: truthy ID and name)
+    valid_mask = (df["league_id"].notna() & (df["league_id"] != 0)
+                  & df["name"].notna() & (df["name"] != ""))
+    if not valid_mask.all():
+        skipped = df.loc[~valid_mask, ["league_id", "name"]].to_dict("records")
+        logging.warning(f"Skipping {len(skipped)} leagues due to missing ID or name: {skipped}")
+        df = df[valid_mask]
+
+    return df.where(df.notna(), None).to_dict("records")
+
 def process_season_data(raw_season_data, league_name=None):
     """Transforms raw season API data for database insertion."""
     # Based on original processors.py
@@ -376,6 +414,14 @@ DB_COLUMN_TYPES = {
     'dangerous_attacks': int
 }
 
+# Column order of the tuples produced by process_fixture_stats_long
+FIXTURE_STATS_COLUMNS = ("fixture_id", "team_id", "period", "timestamp") + tuple(DB_COLUMN_TYPES.keys())
+# API stat code -> (tuple index, db column, target type), resolved once
+STAT_CODE_TO_ROW_SLOT = {
+    api_code: (FIXTURE_STATS_COLUMNS.index(db_column), db_column, DB_COLUMN_TYPES.get(db_column))
+    for api_code, db_column in STAT_CODE_TO_DB_COLUMN.items()
+}
+
 
 def map_period_description(description):
     """Maps API period description to database period string."""
@@ -397,6 +443,7 @@ def process_fixture_stats_long(raw_fixture_data):
     Processes the raw response from the /fixtures/{id}?include=periods.statistics.type endpoint
     into a 'long' format list suitable for the revised fixture_stats table.
     Handles missing stats gracefully.
+    Rows are plain tuples ordered as FIXTURE_STATS_COLUMNS (one per team and period).
     """
     processed_rows = []
     if not raw_fixture_data or 'data' not in raw_fixture_data:
@@ -467,34 +514,27 @@ def process_fixture_stats_long(raw_fixture_data):
 
         # Create a row for each team in this period
         for team_id, team_stats in stats_by_team.items():
-            # Initialize row with all possible columns from the DB schema mapping
-            # Ensure all keys from DB_COLUMN_TYPES are present
-            row = {
-                "fixture_id": fixture_id,
-                "team_id": team_id,
-                "period": period_desc,
-                "timestamp": fetch_time,
-                 # Initialize all stat columns to None
-                **{col: None for col in DB_COLUMN_TYPES.keys()}
-            }
-
-            # Populate the row with available stats, mapping code to db column name
-            for api_code, db_column in STAT_CODE_TO_DB_COLUMN.items():
-                if api_code in team_stats:
-                    raw_value = team_stats[api_code]
-                    target_type = DB_COLUMN_TYPES.get(db_column)
-
-                    if raw_value is None:
-                        row[db_column] = None # Keep None if API value is None
-                        continue
+            # Fixed-order row with all stat columns initialised to None
+            row = [fixture_id, team_id, period_desc, fetch_time] + [None] * len(DB_COLUMN_TYPES)
 
-                    # Attempt safe type conversion using the helper function
-                    row[db_column] = safe_convert(raw_value, target_type, default=None)
-                    if row[db_column] is None and raw_value is not None: # Log if conversion failed but raw value wasn't None
-                         logging.warning(f"Conversion failed for value '{raw_value}' ({type(raw_value).__name__}) to type {target_type.__name__} for {db_column} (API code: {api_code}) in fixture {fixture_id}, team {team_id}, period {period_desc}. Storing NULL.")
+            # Populate the row with available stats, mapping code to its column slot
+            for api_code, raw_value in team_stats.items():
+                slot = STAT_CODE_TO_ROW_SLOT.get(api_code)
+                if slot is None:
+                    continue
+                index, db_column, target_type = slot
 
+                # JSON numbers usually arrive already typed; only fall back to the
+                # safe conversion helper (strings, percentages, mismatches) otherwise
+                if type(raw_value) is target_type:
+                    value = raw_value
+                else:
+                    value = safe_convert(raw_value, target_type, default=None)
+                row[index] = value
+                if value is None and raw_value is not None: # Log if conversion failed but raw value wasn't None
+                     logging.warning(f"Conversion failed for value '{raw_value}' ({type(raw_value).__name__}) to type {target_type.__name__} for {db_column} (API code: {api_code}) in fixture {fixture_id}, team {team_id}, period {period_desc}. Storing NULL.")
 
-            processed_rows.append(row)
+            processed_rows.append(tuple(row))
 
     if not processed_rows and 'periods' in fixture_main_data and fixture_main_data['periods']:
          logging.info(f"No processable statistics found within periods for fixture {fixture_id}.")
@@ -506,16 +546,26 @@ def process_fixture_stats_long(raw_fixture_data):
 
 
 # --- UPDATED: Pre-Match Odds Processor ---
+# Markets (1x2 and others) and bookmakers kept by process_prematch_odds_data
+ODDS_ALLOWED_MARKET_IDS = frozenset({1, 269, 6})
+ODDS_ALLOWED_BOOKMAKER_IDS = frozenset({20, 29})
+
+# Column order of the tuples produced by process_prematch_odds_data
+FIXTURE_ODDS_COLUMNS = (
+    "fixture_id", "market_id", "bookmaker_id", "label", "value", "name",
+    "market_description", "probability", "dp3", "fractional", "american",
+    "winning", "stopped", "total", "handicap", "participants", "api_created_at",
+    "original_label", "latest_bookmaker_update"
+)
+
 def process_prematch_odds_data(raw_odds_data):
     """
     Processes the raw response from the /odds/pre-match/fixtures/{id} endpoint
-    into a list of dictionaries suitable for the updated fixture_odds table.
+    into a list of row tuples (ordered as FIXTURE_ODDS_COLUMNS) suitable for
+    the updated fixture_odds table.
     Includes filtering for specific market_ids and bookmaker_ids.
     """
     processed_odds = []
-    # Define the allowed market and bookmaker IDs
-    ALLOWED_MARKET_IDS = {1, 269, 6}
-    ALLOWED_BOOKMAKER_IDS = {20, 29}
 
     if not raw_odds_data or 'data' not in raw_odds_data:
         logging.warning("Invalid or empty odds data received for processing.")
@@ -542,7 +592,7 @@ def process_prematch_odds_data(raw_odds_data):
         label = odd_item.get("label") # Needed for unique constraint
 
         # --- Filtering Logic ---
-        if market_id not in ALLOWED_MARKET_IDS or bookmaker_id not in ALLOWED_BOOKMAKER_IDS:
+        if market_id not in ODDS_ALLOWED_MARKET_IDS or bookmaker_id not in ODDS_ALLOWED_BOOKMAKER_IDS:
             filtered_count += 1
             # logging.debug(f"Skipping odd due to market/bookmaker filter: Market={market_id}, Bookmaker={bookmaker_id}")
             continue
@@ -554,28 +604,29 @@ def process_prematch_odds_data(raw_odds_data):
              continue
 
         # Extract all requested fields, performing safe type conversions
-        processed_item = {
-            "fixture_id": fixture_id,
-            "market_id": market_id,
-            "bookmaker_id": bookmaker_id,
-            "label": label,
-            "value": safe_convert(odd_item.get("value"), float),
-            "name": odd_item.get("name"),
-            "market_description": odd_item.get("market_description"),
-            "probability": safe_convert(odd_item.get("probability"), float), # Handles "54.64%"
-            "dp3": odd_item.get("dp3"), # Store as TEXT
-            "fractional": odd_item.get("fractional"), # Store as TEXT
-            "american": odd_item.get("american"), # Store as TEXT
-            "winning": safe_convert(odd_item.get("winning"), bool), # Convert to BOOLEAN (0/1)
-            "stopped": safe_convert(odd_item.get("stopped"), bool), # Convert to BOOLEAN (0/1)
-            "total": safe_convert(odd_item.get("total"), float), # Convert to REAL
-            "handicap": safe_convert(odd_item.get("handicap"), float), # Can be None, 0.0, -0.25 etc.
+        # (values in FIXTURE_ODDS_COLUMNS order)
+        processed_item = (
+            fixture_id,
+            market_id,
+            bookmaker_id,
+            label,
+            safe_convert(odd_item.get("value"), float), # value
+            odd_item.get("name"),
+            odd_item.get("market_description"),
+            safe_convert(odd_item.get("probability"), float), # probability, handles "54.64%"
+            odd_item.get("dp3"), # Store as TEXT
+            odd_item.get("fractional"), # Store as TEXT
+            odd_item.get("american"), # Store as TEXT
+            safe_convert(odd_item.get("winning"), bool), # winning, convert to BOOLEAN (0/1)
+            safe_convert(odd_item.get("stopped"), bool), # stopped, convert to BOOLEAN (0/1)
+            safe_convert(odd_item.get("total"), float), # total, convert to REAL
+            safe_convert(odd_item.get("handicap"), float), # handicap, can be None, 0.0, -0.25 etc.
             # Store participants as JSON string if it's complex, otherwise as is
-            "participants": odd_item.get("participants"), # Let storage handle JSON dump
-            "api_created_at": odd_item.get("created_at"), # Store timestamp string
-            "original_label": odd_item.get("original_label"),
-            "latest_bookmaker_update": odd_item.get("latest_bookmaker_update") # Store timestamp string
-        }
+            odd_item.get("participants"),
+            odd_item.get("created_at"), # api_created_at, store timestamp string
+            odd_item.get("original_label"),
+            odd_item.get("latest_bookmaker_update") # Store timestamp string
+        )
 
         processed_odds.append(processed_item)
         processed_count += 1
@@ -587,6 +638,11 @@ def process_prematch_odds_data(raw_odds_data):
 # Assume safe_convert helper function exists:
 # def safe_convert(value, target_type, default=None): ...
 
+# Column order of the tuples produced by process_pressure_data
+FIXTURE_TIMELINE_PRESSURE_COLUMNS = (
+    "fixture_id", "minute", "participant_id", "pressure_index", "event_type", "api_event_id", "timestamp"
+)
+
 def process_pressure_data(raw_fixture_data_with_pressure):
     """
     Processes the raw response from the /fixtures/{id}?include=pressure endpoint
@@ -596,8 +652,8 @@ def process_pressure_data(raw_fixture_data_with_pressure):
         raw_fixture_data_with_pressure (dict): The raw JSON response dictionary.
 
     Returns:
-        list: A list of dictionaries, each representing a row for the
-              fixture_timeline table with pressure data. Returns empty list on error
+        list: A list of row tuples (ordered as FIXTURE_TIMELINE_PRESSURE_COLUMNS),
+              each representing a row for the fixture_timeline table with pressure data. Returns empty list on error
               or if no pressure data is found.
     """
     processed_pressure_rows = []
@@ -641,23 +697,26 @@ def process_pressure_data(raw_fixture_data_with_pressure):
             continue
 
         # Use safe_convert helper function (ensure it's defined in processors.py)
-        processed_row = {
-            "fixture_id": fixture_id,
-            "minute": safe_convert(minute, int),
-            "participant_id": safe_convert(participant_id, int),
-            "pressure_index": safe_convert(pressure_value, float),
-            "event_type": "pressure", # Specific event type for pressure data
-            "api_event_id": safe_convert(api_event_id, int), # Store the original ID
-            # Other timeline fields are set to None for pressure-specific rows
-            "timestamp": None,
-            # created_at/updated_at are handled by the DB
-        }
+        minute = safe_convert(minute, int)
+        participant_id = safe_convert(participant_id, int)
+        pressure_index = safe_convert(pressure_value, float)
 
         # Additional validation after conversion (check if conversion resulted in None)
-        if processed_row['minute'] is None or processed_row['participant_id'] is None or processed_row['pressure_index'] is None:
+        if minute is None or participant_id is None or pressure_index is None:
              logging.warning(f"Skipping pressure item after conversion failed for key fields in fixture {fixture_id}: {item}")
              continue
 
+        # Values in FIXTURE_TIMELINE_PRESSURE_COLUMNS order; created_at/updated_at are handled by the DB
+        processed_row = (
+            fixture_id,
+            minute,
+            participant_id,
+            pressure_index,
+            "pressure", # event_type: specific event type for pressure data
+            safe_convert(api_event_id, int), # Store the original ID
+            None, # timestamp: other timeline fields are None for pressure-specific rows
+        )
+
         processed_pressure_rows.append(processed_row)
 
     # Log the final count of successfully processed rows
@@ -1,6 +1,8 @@
 # src/data/storage.py
 import sqlite3
 import logging
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path # Assuming DATABASE_PATH is a Path object
 
 # Assuming DATABASE_PATH is imported correctly from src.config
@@ -23,6 +25,15 @@ except ImportError:
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Database Setup ---
+MAX_SQL_VARIABLES = 999 # Bound-parameter limit of SQLite builds before 3.32
+CONNECTION_PRAGMAS = (
+    "journal_mode = WAL",
+    "synchronous = NORMAL",
+    "temp_store = MEMORY",
+    "cache_size = -131072",
+    "mmap_size = 268435456",
+)
+
 def get_db_connection():
     """Establishes a connection to the SQLite database."""
     try:
@@ -33,6 +44,10 @@ def get_db_connection():
         conn = sqlite3.connect(DATABASE_PATH)
         conn.row_factory = sqlite3.Row
         # conn.execute("PRAGMA foreign_keys = ON") # Optional: Enforce foreign keys
+        # Bulk-ingest tuning: WAL + NORMAL sync (one cheap fsync per commit),
+        # in-memory temp storage, 128MB page cache and 256MB memory-mapped I/O
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(f"PRAGMA {pragma}")
         logging.info(f"Connected to database: {DATABASE_PATH}")
         return conn
     except sqlite3.Error as e:
@@ -65,6 +80,92 @@ def create_table(conn, create_table_sql):
         if cursor:
             cursor.close()
 
+# --- Helper function used by table creation functions for indexes ---
+def create_index(conn, index_name, table_name, columns, analyze=True):
+    """
+    Creates an index on table_name(columns) if it doesn't exist.
+    Runs ANALYZE on the table the first time the index is built so the
+    query planner's statistics reflect it.
+    Returns True if the index was newly created.
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,))
+        if cursor.fetchone():
+            return False
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})")
+        if analyze:
+            cursor.execute(f"ANALYZE {table_name}")
+        conn.commit()
+        logging.info(f"Index '{index_name}' created on {table_name}({', '.join(columns)}).")
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"Database error creating index {index_name}: {e}")
+        try:
+            conn.rollback()
+        except sqlite3.Error as rb_err:
+            logging.error(f"Rollback failed after index creation error: {rb_err}")
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+
+def drop_secondary_indexes(conn, table_name):
+    """
+    Drops the non-unique indexes on table_name ahead of a bulk load, so inserts
+    only maintain the table and its UNIQUE constraint index (which INSERT OR
+    IGNORE relies on, and which has no stored SQL so it is never dropped).
+    Returns the CREATE INDEX statements to pass to recreate_indexes afterwards.
+    """
+    cursor = None
+    index_sqls = []
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table_name,)
+        )
+        for name, sql in cursor.fetchall():
+            if sql.lstrip().upper().startswith("CREATE UNIQUE"):
+                continue
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+            index_sqls.append(sql)
+        conn.commit()
+        if index_sqls:
+            logging.info(f"Dropped {len(index_sqls)} secondary index(es) on {table_name} for bulk load.")
+    except sqlite3.Error as e:
+        logging.error(f"Database error dropping indexes on {table_name}: {e}")
+        try:
+            conn.rollback()
+        except sqlite3.Error as rb_err:
+            logging.error(f"Rollback failed after index drop error: {rb_err}")
+    finally:
+        if cursor:
+            cursor.close()
+    return index_sqls
+
+def recreate_indexes(conn, index_sqls):
+    """Rebuilds indexes from the statements returned by drop_secondary_indexes."""
+    if not index_sqls:
+        return
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        for sql in index_sqls:
+            cursor.execute(sql)
+        conn.commit()
+        logging.info(f"Recreated {len(index_sqls)} index(es) after bulk load.")
+    except sqlite3.Error as e:
+        logging.error(f"Database error recreating indexes: {e}")
+        try:
+            conn.rollback()
+        except sqlite3.Error as rb_err:
+            logging.error(f"Rollback failed after index creation error: {rb_err}")
+    finally:
+        if cursor:
+            cursor.close()
+
 # --- Table Creation Functions ---
 
 def create_leagues_table(conn):
@@ -164,10 +265,26 @@ def create_schedules_table(conn):
     );"""
     if create_table(conn, sql):
         logging.info("Schedules table (enhanced) ensured.")
+        create_schedules_status_index(conn)
     else:
         logging.error("Failed to ensure schedules table.")
 # --- End of REVISED function ---
 
+def create_schedules_status_index(conn):
+    """
+    Ensures the (status, start_time) index used to find finished fixtures,
+    newest first, for the odds and pressure syncs. fixture_id is the rowid,
+    so the index covers those lookups. No-op if schedules doesn't exist yet.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schedules'")
+        exists = cursor.fetchone() is not None
+    finally:
+        cursor.close()
+    if exists:
+        create_index(conn, "ix_schedules_status_start", "schedules", ["status", "start_time"])
+
 
 # --- Fixture Stats Table (REVISED SCHEMA - Aligned with Processor using Underscores) ---
 def create_fixture_stats_table(conn):
@@ -276,6 +393,11 @@ def create_fixture_odds_table(conn):
     );"""
     if create_table(conn, sql):
         logging.info("Fixture_Odds table ensured (with all columns).")
+        # Covering index for the 1x2 odds lookups in build_ml_dataset
+        # (trailing 'value' lets SQLite answer them from the index alone)
+        create_index(conn, "ix_fo_lookup", "fixture_odds",
+                     ["fixture_id", "market_id", "bookmaker_id", "label", "value"])
+        create_schedules_status_index(conn)
     else:
         logging.error("Failed to ensure fixture_odds table.")
 # --- End of NEW function ---
@@ -283,18 +405,64 @@ def create_fixture_odds_table(conn):
 
 # --- Data Storage ---
 
-def store_data(conn, table_name, data_list, primary_key_column="id", use_insert_ignore=False):
+@lru_cache(maxsize=256)
+def build_insert_sql(table_name, columns, insert_mode, primary_key_column, row_count=1):
+    """
+    Builds (and caches per table, column tuple, mode and row count) the
+    store_data statement inserting row_count rows. insert_mode is
+    "INSERT OR IGNORE", "INSERT OR REPLACE" or "UPSERT" (ON CONFLICT on
+    primary_key_column, setting updated_at).
+    """
+    row_sql = f"({', '.join(['?' for _ in columns])})"
+    values_sql = ', '.join([row_sql] * row_count)
+    if insert_mode == "UPSERT":
+        update_columns = [col for col in columns if col not in (primary_key_column, 'created_at', 'updated_at')]
+        update_clause = ', '.join([f"{col} = excluded.{col}" for col in update_columns] + ["updated_at = CURRENT_TIMESTAMP"])
+        return (f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES {values_sql} "
+                f"ON CONFLICT({primary_key_column}) DO UPDATE SET {update_clause};")
+    return f"{insert_mode} INTO {table_name} ({', '.join(columns)}) VALUES {values_sql};"
+
+def begin_savepoint(conn, name):
+    """
+    Opens savepoint name inside the caller's transaction (starting one if none
+    is open), so a failed store can be undone without touching the caller's
+    earlier uncommitted rows.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    conn.execute(f"SAVEPOINT {name}")
+
+def release_savepoint(conn, name, rollback=False):
+    """Releases savepoint name, first undoing everything written since it when rollback is set."""
+    if rollback:
+        conn.execute(f"ROLLBACK TO {name}")
+    conn.execute(f"RELEASE {name}")
+
+def store_data(conn, table_name, data_list, primary_key_column="id", use_insert_ignore=False, use_upsert=False, commit=True):
     """
-    Generic function to insert/replace or insert/ignore data into a specified table.
+    Generic function to insert/replace, insert/ignore or upsert data into a specified table.
     Assumes data_list is a list of dictionaries where keys match column names.
 
     Args:
         conn: Database connection object.
         table_name (str): Name of the table to insert into.
         data_list (list): List of dictionaries representing rows.
-        primary_key_column (str): Name of the primary key column (used for logging/counting).
+        primary_key_column (str): Name of the primary key column (used for logging/counting,
+                                   and as the conflict target when use_upsert is set).
                                    Not directly used for INSERT OR IGNORE logic.
         use_insert_ignore (bool): If True, use INSERT OR IGNORE. Otherwise, use INSERT OR REPLACE.
+        use_upsert (bool): If True (and use_insert_ignore is False), use
+                           INSERT ... ON CONFLICT(primary_key_column) DO UPDATE, which updates
+                           the existing row in place (keeping created_at) and sets updated_at.
+                           The table must have an updated_at column.
+        commit (bool): If False, the rows join the open transaction and the caller
+                       commits (e.g. once for a whole sync run). The call runs in a
+                       savepoint: on error all of its rows are undone, earlier
+                       uncommitted work is kept, and None is returned.
+
+    Returns:
+        int: Rows inserted (or inserted/replaced/updated); 0 on error with commit=True,
+             None on error with commit=False.
     """
     if not data_list:
         logging.warning(f"No processed data provided for table {table_name}.")
@@ -318,52 +486,66 @@ def store_data(conn, table_name, data_list, primary_key_column="id", use_insert_
     if 'id' in columns and (use_insert_ignore or table_name == "fixture_odds"): # Exclude for odds table too
         columns.remove('id')
 
-    placeholders = ', '.join(['?' for _ in columns])
-    insert_mode = "INSERT OR IGNORE" if use_insert_ignore else "INSERT OR REPLACE"
-    sql = f"{insert_mode} INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders});"
+    columns = tuple(columns)
+    if use_insert_ignore:
+        insert_mode = "INSERT OR IGNORE"
+    elif use_upsert:
+        insert_mode = "UPSERT"
+    else:
+        insert_mode = "INSERT OR REPLACE"
+    sql = build_insert_sql(table_name, columns, insert_mode, primary_key_column) # Single-row form, for error reporting
+
+    # Prepare values for all valid items up front, ordered to match columns derived
+    # from first_valid_item (missing keys become NULL)
+    rows = []
+    for item in data_list:
+        if not item or not isinstance(item, dict):
+            skipped_count += 1
+            continue
+        rows.append(tuple(item.get(col) for col in columns))
+    # Several rows per INSERT ... VALUES (...), (...) statement: one VM run
+    # per chunk instead of per row, kept under SQLite's bound-parameter limit
+    rows_per_statement = max(1, MAX_SQL_VARIABLES // len(columns))
+    start = 0 # Start of the chunk being inserted, for error reporting
 
-    item_for_error = None # Store sample item for error reporting
     try:
-        for item in data_list:
-            item_for_error = item # Keep track of last processed item
-            if not item or not isinstance(item, dict):
-                skipped_count += 1
-                continue
-
-            # Prepare values, ensuring order matches columns derived from first_valid_item
-            # Handle potential missing keys in some items gracefully
-            values = [item.get(col) for col in columns]
-
-            # Execute the INSERT statement
-            cursor.execute(sql, values)
-
-            # Update counts based on rowcount
-            if cursor.rowcount > 0:
-                # How to differentiate insert vs replace for INSERT OR REPLACE is tricky without extra queries.
-                # For INSERT OR IGNORE, rowcount > 0 means inserted.
-                # For INSERT OR REPLACE, rowcount > 0 means inserted or replaced.
-                # We'll simplify the counting for now.
-                inserted_count += 1 # Count successful operations (insert or replace/ignore)
-            elif use_insert_ignore:
-                 ignored_count += 1 # rowcount is 0 for IGNORE
+        if not commit:
+            begin_savepoint(conn, "store_data")
+        for start in range(0, len(rows), rows_per_statement):
+            chunk = rows[start:start + rows_per_statement]
+            chunk_sql = build_insert_sql(table_name, columns, insert_mode, primary_key_column, len(chunk))
+            cursor.execute(chunk_sql, [value for row in chunk for value in row])
+            # rowcount per statement: rows inserted (IGNORE) or inserted/replaced (REPLACE)
+            inserted_count += max(cursor.rowcount, 0)
+        if use_insert_ignore:
+            ignored_count = len(rows) - inserted_count
 
-        conn.commit()
+        if commit:
+            conn.commit()
+        else:
+            release_savepoint(conn, "store_data")
         if use_insert_ignore:
              logging.info(f"Successfully stored data into {table_name} using INSERT OR IGNORE. Inserted: {inserted_count}, Ignored (duplicates/skipped): {ignored_count + skipped_count}")
         else:
-             # For INSERT OR REPLACE, inserted_count represents the total number of rows affected (inserted or replaced)
-             logging.info(f"Successfully stored data into {table_name} using INSERT OR REPLACE. Affected rows: {inserted_count}, Skipped: {skipped_count}")
+             # For INSERT OR REPLACE / UPSERT, inserted_count represents the total number of rows affected (inserted or replaced/updated)
+             logging.info(f"Successfully stored data into {table_name} using {insert_mode}. Affected rows: {inserted_count}, Skipped: {skipped_count}")
         return inserted_count # Return total affected/inserted rows
     except sqlite3.Error as e:
         logging.error(f"Database error during storage in {table_name} ({insert_mode}): {e}") # Use logging
         logging.error(f"SQL attempted: {sql}")
-        logging.error(f"Item causing error (potentially): {item_for_error}")
+        if rows:
+            logging.error(f"Failing statement covered rows {start}-{min(start + rows_per_statement, len(rows)) - 1} "
+                          f"of the batch; first row of it: {dict(zip(columns, rows[start]))}")
         # Check for common errors like missing columns in the item
         if "has no column named" in str(e):
              logging.error(f"Possible cause: Item dictionary might be missing expected keys matching table columns.")
              logging.error(f"Expected columns based on first item (excluding 'id' if applicable): {columns}")
-        conn.rollback()
-        return 0
+        if commit:
+            conn.rollback()
+            return 0
+        if conn.in_transaction:
+            release_savepoint(conn, "store_data", rollback=True)
+        return None
     finally:
         if cursor:
             cursor.close()
@@ -396,18 +578,155 @@ def create_fixture_timeline_table(conn):
     # Assumes create_table is defined elsewhere in storage.py
     if create_table(conn, sql):
         logging.info("Fixture_Timeline table ensured (with pressure index fields).")
+        # Lets the "already has pressure rows?" probe seek straight to (fixture, event type)
+        create_index(conn, "ix_timeline_fixture_event", "fixture_timeline", ["fixture_id", "event_type"])
+        create_schedules_status_index(conn)
     else:
         logging.error("Failed to ensure fixture_timeline table.")
 
-# store_fixture_stats_long should work without changes,
-# as it dynamically gets columns from the input data.
-def store_fixture_stats_long(conn, stats_rows):
+def create_raw_responses_table(conn):
+    """
+    Creates the raw_responses table: the zlib-compressed API response body per
+    fixture and endpoint, kept for reprocessing instead of raw files on disk.
+    """
+    sql = """
+    CREATE TABLE IF NOT EXISTS raw_responses (
+        fixture_id INTEGER NOT NULL,
+        endpoint TEXT NOT NULL,          -- API endpoint the payload was fetched from
+        fetched_at TEXT,                 -- ISO timestamp of the fetch
+        payload BLOB,                    -- zlib-compressed response body (JSON bytes)
+        PRIMARY KEY (fixture_id, endpoint)
+    );"""
+    if create_table(conn, sql):
+        logging.info("Raw_Responses table ensured.")
+    else:
+        logging.error("Failed to ensure raw_responses table.")
+
+def store_raw_responses(conn, raw_rows, commit=True):
+    """
+    Stores (fixture_id, endpoint, fetched_at, payload) tuples with one executemany,
+    replacing earlier payloads for the same fixture and endpoint.
+    With commit=False the rows join the open transaction and are committed by
+    the caller's next store (e.g. store_rows), so both land together; a failed
+    call is undone through a savepoint (see store_data).
+    Returns the number of rows written (0 on error).
+    """
+    if not raw_rows:
+        return 0
+    cursor = conn.cursor()
+    try:
+        if not commit:
+            begin_savepoint(conn, "store_raw_responses")
+        cursor.executemany(
+            "INSERT OR REPLACE INTO raw_responses (fixture_id, endpoint, fetched_at, payload) VALUES (?, ?, ?, ?);",
+            raw_rows
+        )
+        if commit:
+            conn.commit()
+        else:
+            release_savepoint(conn, "store_raw_responses")
+        return len(raw_rows)
+    except sqlite3.Error as e:
+        logging.error(f"Database error during storage in raw_responses: {e}")
+        if commit:
+            conn.rollback()
+        elif conn.in_transaction:
+            release_savepoint(conn, "store_raw_responses", rollback=True)
+        return 0
+    finally:
+        cursor.close()
+
+def create_raw_schedule_hashes_table(conn):
+    """
+    Creates the raw_schedule_hashes table: the SHA-1 of the last archived schedule
+    response per season, so unchanged responses are not archived again.
+    """
+    sql = """
+    CREATE TABLE IF NOT EXISTS raw_schedule_hashes (
+        season_id INTEGER PRIMARY KEY,
+        sha1 TEXT NOT NULL,              -- SHA-1 of the response body
+        path TEXT                        -- Archive file holding that body
+    );"""
+    if create_table(conn, sql):
+        logging.info("Raw_Schedule_Hashes table ensured.")
+    else:
+        logging.error("Failed to ensure raw_schedule_hashes table.")
+
+def load_raw_schedule_hashes(conn):
+    """Returns {season_id: sha1} for every archived schedule response."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT season_id, sha1 FROM raw_schedule_hashes")
+        return {row[0]: row[1] for row in cursor}
+    except sqlite3.Error as e:
+        logging.error(f"Database error reading raw_schedule_hashes: {e}")
+        return {}
+    finally:
+        cursor.close()
+
+def store_raw_schedule_hashes(conn, hash_rows, commit=True):
+    """
+    Stores (season_id, sha1, path) tuples, replacing each season's previous hash.
+    With commit=False the rows join the open transaction (see store_raw_responses).
+    Returns the number of rows written.
+    """
+    if not hash_rows:
+        return 0
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO raw_schedule_hashes (season_id, sha1, path) VALUES (?, ?, ?);",
+            hash_rows
+        )
+        if commit:
+            conn.commit()
+        return len(hash_rows)
+    except sqlite3.Error as e:
+        logging.error(f"Database error during storage in raw_schedule_hashes: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def store_rows(conn, table_name, columns, rows, use_insert_ignore=False):
+    """
+    Inserts pre-built row tuples (values ordered as columns) with one executemany,
+    skipping the per-row dict handling of store_data.
+    Uses INSERT OR IGNORE if use_insert_ignore is set, otherwise INSERT OR REPLACE.
+    Returns the number of rows inserted (or inserted/replaced).
+    """
+    if not rows:
+        logging.warning(f"No processed rows provided for table {table_name}.")
+        return 0
+
+    insert_mode = "INSERT OR IGNORE" if use_insert_ignore else "INSERT OR REPLACE"
+    placeholders = ', '.join(['?' for _ in columns])
+    sql = f"{insert_mode} INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders});"
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(sql, rows)
+        inserted_count = max(cursor.rowcount, 0)
+        conn.commit()
+        logging.info(f"Successfully stored rows into {table_name} using {insert_mode}. Affected rows: {inserted_count}, Not affected: {len(rows) - inserted_count}")
+        return inserted_count
+    except sqlite3.Error as e:
+        logging.error(f"Database error during storage in {table_name} ({insert_mode}): {e}")
+        logging.error(f"SQL attempted: {sql}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+
+def store_fixture_stats_long(conn, stats_rows, columns):
     """
     Stores processed fixture statistics rows (long format) into the fixture_stats table.
+    stats_rows are tuples ordered as columns (see processors.FIXTURE_STATS_COLUMNS).
     Uses INSERT OR IGNORE to handle the UNIQUE constraint on (fixture_id, team_id, period).
+    Rows are inserted in that index's key order, so the unique index B-tree is
+    filled page by page instead of at scattered positions.
     """
-    # Use the generic store_data function with use_insert_ignore=True
-    return store_data(conn, "fixture_stats", stats_rows, primary_key_column="id", use_insert_ignore=True)
+    unique_key = itemgetter(*(columns.index(col) for col in ("fixture_id", "team_id", "period")))
+    return store_rows(conn, "fixture_stats", columns, sorted(stats_rows, key=unique_key), use_insert_ignore=True)
 
 
 # --- Triggers ---
@@ -469,3 +788,13 @@ def create_update_trigger(conn, table_name, pk_column):
     finally:
         if cursor:
             cursor.close()
+
+def drop_update_trigger(conn, table_name):
+    """Drops the 'updated_at' trigger created by create_update_trigger, if present."""
+    trigger_name = f"update_{table_name}_updated_at"
+    try:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+        conn.commit()
+        logging.info(f"Trigger '{trigger_name}' dropped (if it existed) for table '{table_name}'.")
+    except sqlite3.Error as e:
+        logging.error(f"Database error dropping trigger {trigger_name}: {e}")
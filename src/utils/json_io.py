@@ -0,0 +1,37 @@
+import json
+
+try:
+    import orjson # Optional: faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+
+def parse_json(payload):
+    """Parses JSON bytes/str, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+def read_json(file_path):
+    """Loads a JSON file, using orjson when it is installed."""
+    with open(file_path, "rb") as f:
+        return parse_json(f.read())
+
+def write_json(file_path, data, indent=True):
+    """
+    Writes data to a JSON file, using orjson when it is installed.
+    indent=True keeps the 2-space layout used for raw files meant for inspection.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        payload = orjson.dumps(data, option=option)
+    else:
+        if indent:
+            payload = json.dumps(data, indent=2)
+        else:
+            payload = json.dumps(data, separators=(",", ":")) # Compact, like orjson
+        payload = payload.encode("utf-8")
+    with open(file_path, "wb") as f:
+        f.write(payload)
+    return file_path